@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Compare advice throughput of the old one-REQ-socket-per-advice behavior
+against the persistent pipelined DEALER channel.
+
+Starts a ClientDaemon on localhost and only measures the advice/ack path
+(no command execution is waited on).
+
+    python tests/benchmark/bench_advice_channel.py [count]
+"""
+
+import os
+import sys
+import subprocess
+import time
+
+import zmq
+import simplejson
+
+from therapyst.client import Client
+from therapyst.data import adviceFactory
+
+ADVICE_PORT = 25557
+RANT_PORT = 25556
+COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+
+def start_daemon():
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "therapyst.client",
+         "-p1", str(ADVICE_PORT), "-p2", str(RANT_PORT)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        cwd=os.path.join(os.path.dirname(__file__), "..", ".."))
+    time.sleep(1)
+    return proc
+
+
+def legacy_send(context, advice):
+    socket = context.socket(zmq.REQ)
+    socket.connect("tcp://127.0.0.1:{}".format(ADVICE_PORT))
+    socket.send_unicode(simplejson.dumps(advice._asdict()))
+    resp = socket.recv_unicode()
+    socket.close()
+    return advice.id in resp
+
+
+def bench(name, func, advicelist):
+    start = time.time()
+    for advice in advicelist:
+        func(advice)
+    elapsed = time.time() - start
+    print("{:<20} {:>8} advice {:>8.3f}s {:>10.1f} msgs/sec".format(
+        name, len(advicelist), elapsed, len(advicelist) / elapsed))
+
+
+def main():
+    proc = start_daemon()
+    try:
+        context = zmq.Context()
+        bench("legacy REQ", lambda a: legacy_send(context, a),
+              [adviceFactory("true") for _ in range(COUNT)])
+
+        client = Client("127.0.0.1", "", "", advice_port=ADVICE_PORT,
+                        rant_port=RANT_PORT)
+        client.start()
+        bench("pipelined (block)", client.send_advice,
+              [adviceFactory("true") for _ in range(COUNT)])
+        start = time.time()
+        bench("pipelined", lambda a: client.send_advice(a, block=False),
+              [adviceFactory("true") for _ in range(COUNT)])
+        client.flush_advice()
+        print("{:<20} flushed after {:.3f}s".format("", time.time() - start))
+    finally:
+        proc.kill()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+"""
+Encode/decode cost of Advice and Rants per codec for 1 KB, 1 MB and
+100 MB command outputs.  Decoding is done from zmq.Frames, as received
+with recv_multipart(copy=False).
+
+    python tests/benchmark/bench_codec.py
+"""
+
+import sys
+import time
+
+import zmq
+
+from therapyst.codec import CODECS
+from therapyst.data import adviceFactory, rantFactory
+
+SIZES = (("1KB", 1 << 10), ("1MB", 1 << 20), ("100MB", 100 << 20))
+
+
+def timed(func, repeat):
+    start = time.time()
+    for _ in range(repeat):
+        result = func()
+    return (time.time() - start) / repeat, result
+
+
+def main():
+    advice = adviceFactory("journalctl -b")
+    for codec in CODECS.values():
+        elapsed, frames = timed(lambda: codec.encode(advice), 10000)
+        frames = [zmq.Frame(frame) for frame in frames]
+        decode, _ = timed(lambda: codec.decode_advice(frames), 10000)
+        print("{:<7} advice       encode {:>10.1f}us decode "
+              "{:>10.1f}us".format(codec.name, elapsed * 1e6, decode * 1e6))
+    for label, size in SIZES:
+        output = b"x" * size
+        rant = rantFactory(output, 0, advice)
+        repeat = 3 if size > (1 << 20) else 100
+        for codec in CODECS.values():
+            elapsed, frames = timed(lambda: codec.encode(rant), repeat)
+            wire = sum(len(frame) for frame in frames)
+            frames = [zmq.Frame(frame) for frame in frames]
+            decode, _ = timed(lambda: codec.decode_rant(frames), repeat)
+            print("{:<7} rant {:>6}  encode {:>10.1f}us decode {:>10.1f}us "
+                  "wire {} bytes".format(codec.name, label, elapsed * 1e6,
+                                         decode * 1e6, wire))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+CPU cost versus bandwidth saved when compressing typical fleet output
+(log lines, ps listings).  For each algorithm and level prints the
+compression ratio, compress/decompress time and the total time to ship
+the result over a 100 Mbit and a 1 Gbit link.
+
+    python tests/benchmark/bench_compression.py [megabytes]
+"""
+
+import sys
+import time
+import random
+
+from therapyst.compression import ALGORITHMS, compress, compressionSpec, \
+    decompress
+
+MEGABYTES = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+LINKS = (("100Mbit", 100e6 / 8), ("1Gbit", 1e9 / 8))
+LEVELS = {"zlib": (1, 6, 9), "lzma": (0, 1, 6)}
+
+
+def sample_output(size):
+    random.seed(0)
+    units = ["sshd", "cron", "kernel", "systemd", "nfsd", "dockerd"]
+    lines = []
+    total = 0
+    while total < size:
+        line = "Oct 17 12:{:02d}:{:02d} host{:03d} {}[{}]: {} {}\n".format(
+            random.randint(0, 59), random.randint(0, 59),
+            random.randint(0, 300), random.choice(units),
+            random.randint(100, 40000),
+            random.choice(["Accepted publickey for", "Started session",
+                           "Connection closed by", "out of memory:"]),
+            random.randint(0, 1 << 32))
+        lines.append(line)
+        total += len(line)
+    return "".join(lines).encode("utf-8")
+
+
+def main():
+    data = sample_output(MEGABYTES << 20)
+    print("{} bytes of log output".format(len(data)))
+    header = "{:<10} {:>7} {:>11} {:>11}".format(
+        "algo", "ratio", "compress", "decompress")
+    for link, _ in LINKS:
+        header += " {:>11}".format(link)
+    print(header)
+    row = "{:<10} {:>7.1f} {:>10.3f}s {:>10.3f}s".format(
+        "none", 1.0, 0, 0)
+    for _, rate in LINKS:
+        row += " {:>10.3f}s".format(len(data) / rate)
+    print(row)
+    for algo in sorted(ALGORITHMS):
+        for level in LEVELS[algo]:
+            spec = compressionSpec(algo, level, threshold=0)
+            start = time.time()
+            _, wire = compress(data, spec)
+            compress_time = time.time() - start
+            start = time.time()
+            decompress(algo, wire)
+            decompress_time = time.time() - start
+            row = "{:<10} {:>7.1f} {:>10.3f}s {:>10.3f}s".format(
+                "{}:{}".format(algo, level), len(data) / len(wire),
+                compress_time, decompress_time)
+            for _, rate in LINKS:
+                row += " {:>10.3f}s".format(
+                    compress_time + len(wire) / rate + decompress_time)
+            print(row)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+Thread count, RSS and startup time of a controller driving a large
+TherapyGroup.  No daemons are needed, zmq connects lazily.
+
+The legacy numbers emulate the old per-Client layout: one zmq.Context,
+one ThreadAuthenticator, a heartbeat thread and a rant listener thread
+per Client.
+
+    python tests/benchmark/bench_controller_threads.py [members] [legacy]
+"""
+
+import sys
+import threading
+import time
+
+import zmq
+from zmq.auth.thread import ThreadAuthenticator
+
+from therapyst.client import Client
+from therapyst.thera import TherapyGroup
+
+MEMBERS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+LEGACY = len(sys.argv) > 2 and sys.argv[2] == "legacy"
+
+
+def rss_mb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS"):
+                return int(line.split()[1]) / 1024.0
+
+
+def legacy_client(stop):
+    context = zmq.Context()
+    auth = ThreadAuthenticator(context)
+    auth.start()
+    for name in ("heartbeater", "rant_listener"):
+        thread = threading.Thread(name=name, target=stop.wait)
+        thread.daemon = True
+        thread.start()
+    return context, auth
+
+
+def main():
+    stop = threading.Event()
+    start = time.time()
+    if LEGACY:
+        # Kept referenced so the legacy contexts stay open while measured
+        members = [legacy_client(stop) for _ in range(MEMBERS)]
+    else:
+        members = [Client("127.0.0.1", "", "", advice_port=30000 + i,
+                          rant_port=40000 + i) for i in range(MEMBERS)]
+        group = TherapyGroup(members)
+        for member in group.members:
+            member.start()
+    elapsed = time.time() - start
+    time.sleep(0.5)
+    print("{} members{}: startup {:.3f}s threads {} rss {:.1f}MB".format(
+        len(members), " (legacy)" if LEGACY else "", elapsed,
+        threading.active_count(), rss_mb()))
+    stop.set()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
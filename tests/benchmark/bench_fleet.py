@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+"""
+Simulated fleet on localhost: starts N ClientDaemons on distinct ports
+(or ipc sockets with --protocol ipc), drives them through Clients in a
+TherapyGroup (no SSH bootstrap) and reports throughput, latency
+percentiles per stage, controller CPU and thread count.
+
+Every advice runs a command sleeping --duration seconds and printing
+--size bytes.
+
+    python tests/benchmark/bench_fleet.py --daemons 10 --advice 200 \
+        --size 1024 --duration 0 [--broadcast] [--codec framed]
+"""
+
+import os
+import sys
+import time
+import argparse
+import resource
+import subprocess
+import threading
+
+from therapyst.client import Client
+from therapyst.data import adviceFactory
+from therapyst.thera import TherapyGroup
+
+BASE_PORT = 26000
+ROOT = os.path.join(os.path.dirname(__file__), "..", "..")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--daemons", type=int, default=10)
+    parser.add_argument("--advice", type=int, default=200,
+                        help="Advice given to the whole group")
+    parser.add_argument("--size", type=int, default=1024,
+                        help="Bytes of output per command")
+    parser.add_argument("--duration", type=float, default=0,
+                        help="Seconds each command runs")
+    parser.add_argument("--codec", default="json")
+    parser.add_argument("--executor", default="thread")
+    parser.add_argument("--protocol", default="tcp", choices=("tcp", "ipc"))
+    parser.add_argument("--broadcast", action="store_true")
+    return parser.parse_args()
+
+
+def ports(i):
+    base = BASE_PORT + i * 3
+    return base, base + 1, base + 2
+
+
+def start_daemons(count, executor, protocol):
+    procs = []
+    for i in range(count):
+        advice_port, rant_port, broadcast_port = ports(i)
+        procs.append(subprocess.Popen(
+            [sys.executable, "-m", "therapyst.client",
+             "-p1", str(advice_port), "-p2", str(rant_port),
+             "-p3", str(broadcast_port), "-e", executor,
+             "--protocol", protocol],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=ROOT))
+    return procs
+
+
+def wait_ready(members, timeout=30):
+    for member in members:
+        member.send_and_receive(adviceFactory("true"), timeout=timeout)
+
+
+def command(size, duration):
+    parts = []
+    if duration:
+        parts.append("sleep {}".format(duration))
+    if size:
+        parts.append("head -c {} /dev/zero".format(size))
+    if not parts:
+        return "true"
+    return "sh -c '{}'".format("; ".join(parts))
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def main():
+    args = parse_args()
+    procs = start_daemons(args.daemons, args.executor, args.protocol)
+    try:
+        members = []
+        for i in range(args.daemons):
+            advice_port, rant_port, broadcast_port = ports(i)
+            members.append(Client(
+                "127.0.0.1", "", "", name="daemon{}".format(i),
+                advice_port=advice_port, rant_port=rant_port,
+                broadcast_port=broadcast_port, codec=args.codec,
+                protocol=args.protocol))
+        group = TherapyGroup(members, broadcast=args.broadcast,
+                             codec=args.codec)
+        group.start()
+        wait_ready(members)
+        for member in members:
+            member.latency.stages.clear()
+
+        cmd = command(args.size, args.duration)
+        threads = threading.active_count()
+        cpu, start = cpu_seconds(), time.time()
+        futures = [group.give_advice(adviceFactory(cmd))
+                   for _ in range(args.advice)]
+        for future in futures:
+            threads = max(threads, threading.active_count())
+            future.result()
+        elapsed = time.time() - start
+        cpu = cpu_seconds() - cpu
+
+        rants = args.advice * args.daemons
+        print("{} {} daemons, {} advice of {} bytes / {}s, codec {}{}".format(
+            args.daemons, args.protocol, args.advice, args.size,
+            args.duration, args.codec,
+            ", broadcast" if args.broadcast else ""))
+        print("{} rants in {:.3f}s: {:.1f} rants/sec".format(
+            rants, elapsed, rants / elapsed))
+        print("controller cpu {:.3f}s ({:.0f}% of wall), {} threads".format(
+            cpu, 100 * cpu / elapsed, threads))
+        print("{:<18} {:>10} {:>10} {:>10} {:>10}".format(
+            "stage (ms)", "p50", "p95", "p99", "max"))
+        for stage, summary in sorted(group.stats()["group"].items()):
+            print("{:<18} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}".format(
+                stage, *(1000 * summary[key]
+                         for key in ("p50", "p95", "p99", "max"))))
+    finally:
+        for proc in procs:
+            proc.kill()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
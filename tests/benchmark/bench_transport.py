@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+Round trip latency and pipelined throughput of tcp loopback, ipc and
+inproc, with a ClientDaemon running inside this process.
+
+"stats" advice is answered by the daemon without running a command, so
+it measures the transport and codec alone; "true" adds running a command.
+
+    python tests/benchmark/bench_transport.py [count] [codec]
+"""
+
+import sys
+import time
+
+from therapyst.client import Client, ClientDaemon
+from therapyst.data import adviceFactory
+from therapyst.poller import shared_context
+from therapyst.stats import Histogram
+from therapyst.transport import PROTOCOLS
+
+COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+CODEC = sys.argv[2] if len(sys.argv) > 2 else "json"
+ADVICE_PORT, RANT_PORT, BROADCAST_PORT = 27557, 27556, 27558
+
+
+def round_trips(client, make_advice, count):
+    histogram = Histogram()
+    for _ in range(count):
+        start = time.time()
+        client.send_and_receive(make_advice(), timeout=10)
+        histogram.add(time.time() - start)
+    return histogram.summary()
+
+
+def pipelined(client, make_advice, count):
+    advicelist = [make_advice() for _ in range(count)]
+    start = time.time()
+    futures = [client.send_advice(advice, block=False)
+               for advice in advicelist]
+    for future in futures:
+        future.result(timeout=30)
+    for advice in advicelist:
+        client.get_rant(advice)
+    return count / (time.time() - start)
+
+
+def main():
+    print("{:<8} {:<6} {:>10} {:>10} {:>12}".format(
+        "protocol", "advice", "p50 ms", "p99 ms", "pipelined/s"))
+    for protocol in PROTOCOLS:
+        host = "0.0.0.0" if protocol == "tcp" else None
+        daemon = ClientDaemon(advice_port=ADVICE_PORT, rant_port=RANT_PORT,
+                              broadcast_port=BROADCAST_PORT,
+                              protocol=protocol, host=host,
+                              context=shared_context())
+        daemon.start()
+        client = Client("127.0.0.1", "", "", advice_port=ADVICE_PORT,
+                        rant_port=RANT_PORT, broadcast_port=BROADCAST_PORT,
+                        protocol=protocol, codec=CODEC)
+        client.start()
+        try:
+            for name, count in (("stats", COUNT), ("true", COUNT // 10)):
+                def make_advice():
+                    if name == "stats":
+                        return adviceFactory(type="stats")
+                    return adviceFactory("true")
+                summary = round_trips(client, make_advice, count)
+                rate = pipelined(client, make_advice, count)
+                print("{:<8} {:<6} {:>10.3f} {:>10.3f} {:>12.1f}".format(
+                    protocol, name, 1000 * summary["p50"],
+                    1000 * summary["p99"], rate))
+        finally:
+            client.close()
+            daemon.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
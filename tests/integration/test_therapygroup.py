@@ -20,8 +20,7 @@ tests = TherapyGroup.from_dict(client_dict, name='Larry Clan')
 
 advicelist = [adviceFactory("ls -ahl") for _ in range(COUNT)]
 
-for member in tests.members:
-    member.install_and_start_daemon()
+tests.install_and_start_daemons(raise_on_error=True)
 
 # import time
 # start = time.time()
@@ -29,6 +28,6 @@ tests.start()
 for advice in advicelist:
     tests.give_advice(advice)
     result = {member: rant.id for member, rant in tests.hear_rant(advice).items()}
-print([len(elem) for elem in tests._rant_dicts.values()])
+print(len(tests.rants))
 # end = time.time()
 # print(end - start)
@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from therapyst.aio import AsyncClient
+from therapyst.data import adviceFactory
+
+
+def test_ack_timeouts_free_the_window():
+    async def run():
+        client = AsyncClient("127.0.0.1", "", "", advice_port=27990,
+                             rant_port=27991, max_in_flight=1,
+                             ack_timeout=0.05)
+        await client.start()
+        try:
+            for _ in range(2):
+                advice = adviceFactory("true")
+                with pytest.raises(IOError):
+                    await asyncio.wait_for(client.send_advice(advice), 5)
+                assert advice.id not in client._futures
+                assert not client._acks
+        finally:
+            await client.close()
+    asyncio.run(run())
+
+
+def test_lost_acks_of_non_blocking_sends_free_the_window():
+    async def run():
+        client = AsyncClient("127.0.0.1", "", "", advice_port=27992,
+                             rant_port=27993, max_in_flight=2,
+                             ack_timeout=0.05)
+        await client.start()
+        try:
+            futures = [await asyncio.wait_for(client.send_advice(
+                adviceFactory("true"), block=False), 5) for _ in range(3)]
+            for future in futures:
+                with pytest.raises(IOError):
+                    await asyncio.wait_for(future, 5)
+            assert not client._acks
+        finally:
+            await client.close()
+    asyncio.run(run())
+
+
+def test_overload_reject_bounds_outstanding_advice():
+    async def run():
+        client = AsyncClient("127.0.0.1", "", "", advice_port=27994,
+                             rant_port=27995, max_outstanding=1,
+                             overload="reject", ack_timeout=0.2)
+        await client.start()
+        try:
+            first = await client.send_advice(adviceFactory("true"),
+                                             block=False)
+            with pytest.raises(IOError):
+                await client.send_advice(adviceFactory("true"), block=False)
+            with pytest.raises(IOError):
+                await first
+            # The failed advice gave its credit back
+            second = await client.send_advice(adviceFactory("true"),
+                                              block=False)
+            with pytest.raises(IOError):
+                await second
+        finally:
+            await client.close()
+    asyncio.run(run())
@@ -0,0 +1,53 @@
+import time
+
+from therapyst.cache import ResultCache
+from therapyst.client import ClientDaemon
+from therapyst.data import adviceFactory, rantFactory
+
+
+def test_cache_is_bounded_and_expires():
+    cache = ResultCache(max_entries=2)
+    advice = adviceFactory("uname -a")
+    cache.put("a", rantFactory("a", 0, advice))
+    cache.put("b", rantFactory("b", 0, advice), ttl=0.05)
+    cache.put("c", rantFactory("c", 0, advice))
+    assert cache.get("a") is None
+    assert cache.get("b").result == "b"
+    time.sleep(0.1)
+    assert cache.get("b") is None
+    assert cache.get("c").result == "c"
+    assert cache.stats == {"hits": 2, "misses": 2, "evictions": 1,
+                           "bytes": 1}
+
+
+def test_cache_is_bounded_by_result_bytes():
+    cache = ResultCache(max_bytes=10)
+    advice = adviceFactory("cat log")
+    cache.put("a", rantFactory(b"a" * 6, 0, advice))
+    cache.put("b", rantFactory(b"b" * 6, 0, advice))
+    assert cache.get("a") is None
+    cache.put("huge", rantFactory(b"h" * 11, 0, advice))
+    assert cache.get("huge") is None
+    assert cache.get("b").result == b"b" * 6
+    assert cache.stats["bytes"] == 6
+
+
+def test_daemon_answers_duplicates_and_cached_commands():
+    daemon = ClientDaemon(max_threads=1)
+    first = adviceFactory("uname -a", cache=60)
+    daemon._enqueue(first)
+    daemon._enqueue(first)
+    assert daemon.advice_queue.qsize() == 1
+    daemon._recent.put(first.id, rantFactory("Linux", 0, first))
+    daemon._cache.put(first.cmd, rantFactory("Linux", 0, first), 60)
+    daemon._active.discard(first.id)
+
+    daemon._enqueue(first)
+    assert daemon.rant_queue.get_nowait().id == first.id
+    again = adviceFactory("uname -a", cache=60)
+    daemon._enqueue(again)
+    rant = daemon.rant_queue.get_nowait()
+    assert (rant.id, rant.result) == (again.id, "Linux")
+    assert daemon.advice_queue.qsize() == 1
+    assert daemon.cache_stats["cache"]["hits"] == 1
+    daemon.context.term()
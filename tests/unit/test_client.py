@@ -1,3 +1,232 @@
+import errno
+import time
+
 import pytest
 
-print("Why aren't there any unit tests yet dummy :P")
+from therapyst.client import Client, ClientDaemon
+from therapyst.data import adviceFactory, bulkAdviceFactory, rantFactory, \
+    REJECTED
+
+
+class FakeChannel():
+
+    def __init__(self, output=b"", status=0):
+        self.output = [output]
+        self.status = status
+        self.closed = False
+
+    def set_combine_stderr(self, combine):
+        pass
+
+    def exec_command(self, command):
+        self.command = command
+
+    def recv(self, size):
+        return self.output.pop() if self.output else b""
+
+    def recv_exit_status(self):
+        return self.status
+
+    def close(self):
+        self.closed = True
+
+
+class FakeTransport():
+
+    def __init__(self):
+        self.active = True
+        self.sessions = 0
+
+    def is_active(self):
+        return self.active
+
+    def open_session(self):
+        self.sessions += 1
+        return FakeChannel(b"Linux\n")
+
+    def close(self):
+        self.active = False
+
+
+@pytest.fixture
+def client(monkeypatch):
+    client = Client("10.0.0.1", "user", "pass", name="fake")
+    transports = []
+
+    def setup_transport():
+        transports.append(FakeTransport())
+        return transports[-1]
+    monkeypatch.setattr(client, "_setup_transport", setup_transport)
+    client.transports = transports
+    return client
+
+
+def test_commands_share_one_transport(client):
+    for _ in range(5):
+        assert client._exec_command("uname") == "Linux\n"
+    assert len(client.transports) == 1
+    assert client.ssh_stats["handshakes"] == 1
+    assert client.ssh_stats["sessions"] == 5
+
+
+def test_dead_transport_is_replaced(client):
+    client._exec_command("uname")
+    client.transports[0].active = False
+    client._exec_command("uname")
+    assert client.ssh_stats["handshakes"] == 2
+    client.close_ssh()
+    assert not client.transports[1].active
+
+
+def test_sftp_channel_is_reused(client, monkeypatch):
+    class FakeSFTP():
+        def __init__(self):
+            self.channel = FakeChannel()
+
+        def get_channel(self):
+            return self.channel
+
+        def stat(self, path):
+            raise IOError(errno.ENOENT, "missing")
+
+        def close(self):
+            self.channel.closed = True
+
+    monkeypatch.setattr("paramiko.SFTPClient.from_transport",
+                        lambda transport: FakeSFTP())
+    assert not client._dir_exists("therapyst")
+    assert not client._dir_exists("therapyst_venv")
+    assert client.ssh_stats["sftp_channels"] == 1
+
+
+def test_credits_bound_outstanding_advice():
+    client = Client("10.0.0.1", "user", "pass", name="fake",
+                    max_outstanding=1, overload="reject")
+    first, second = adviceFactory("true"), adviceFactory("true")
+    client.take_credit(first)
+    with pytest.raises(IOError):
+        client.take_credit(second)
+    client._deliver_rant(rantFactory("", 0, first))
+    client.take_credit(second)
+
+
+def test_daemon_rejects_advice_beyond_max_queued():
+    daemon = ClientDaemon(max_queued=1)
+    daemon._enqueue(adviceFactory("true"))
+    rejected = adviceFactory("true")
+    daemon._enqueue(rejected)
+    rant = daemon.rant_queue.get_nowait()
+    assert rant.id == rejected.id
+    assert rant.error_code == REJECTED
+    assert daemon.rejected == 1
+    daemon.context.term()
+
+
+def test_bulk_advice_expecting_errors_runs_every_step():
+    daemon = ClientDaemon()
+    bulk = bulkAdviceFactory([adviceFactory("false"), adviceFactory("true")],
+                             error_expected=True)
+    rant = daemon._handle_bulk(bulk)
+    assert [step.error_code for step in rant.rants] == [1, 0]
+    assert rant.error_code == 0
+    daemon.context.term()
+
+
+def test_polling_for_a_rant_keeps_its_future():
+    client = Client("10.0.0.1", "user", "pass", name="fake",
+                    max_outstanding=1, overload="reject")
+    advice = adviceFactory("true")
+    future = client.expect_rant(advice)
+    client.take_credit(advice)
+    assert client.get_rant(advice, block=False) is None
+    client._deliver_rant(rantFactory("", 0, advice))
+    assert future.done()
+    client.take_credit(adviceFactory("true"))
+
+
+def test_rants_are_held_rather_than_dropped_when_the_queue_is_full():
+    daemon = ClientDaemon(max_queued=1)
+    daemon._enqueue(adviceFactory("true"))
+    first, second = adviceFactory("true"), adviceFactory("true")
+    daemon._enqueue(first)
+    daemon._enqueue(second)
+    assert [daemon._next_rant().id for _ in range(2)] == [first.id, second.id]
+    assert daemon._next_rant() is None
+    daemon.context.term()
+
+
+def test_ack_timeout_fails_in_flight_advice_and_returns_credits():
+    client = Client("127.0.0.1", "", "", advice_port=27980, rant_port=27981,
+                    max_outstanding=2, overload="reject", ack_timeout=0.05,
+                    auth=False)
+    client.ready = True
+    first = client.send_advice(adviceFactory("true"), block=False)
+    with pytest.raises(IOError):
+        client.send_advice(adviceFactory("true"))
+    assert isinstance(first.exception(0), IOError)
+    assert not client._in_flight
+    assert not client._queued_at and not client._sent_at
+    for _ in range(2):
+        client.take_credit(adviceFactory("true"))
+    client.close()
+
+
+def test_cancel_expects_no_rant_of_its_own():
+    client = Client("127.0.0.1", "", "", advice_port=27982, rant_port=27983,
+                    auth=False)
+    client.ready = True
+    assert client.cancel(adviceFactory("true"), block=False) is None
+    assert not client._futures
+    assert not client._queued_at
+    client.close()
+
+
+def test_missing_client_holds_up_no_rants_and_gets_its_own_later(
+        monkeypatch):
+    monkeypatch.setattr("therapyst.client.RANT_PEER_GRACE", 0.2)
+    ports = {"advice_port": 27970, "rant_port": 27971,
+             "broadcast_port": 27972}
+    daemon = ClientDaemon(host="127.0.0.1", **ports)
+    daemon.start()
+    # Sends advice but has no rant socket yet
+    missing = Client("127.0.0.1", "", "", auth=False, **ports)
+    missing.ready = True
+    client = Client("127.0.0.1", "", "", auth=False, **ports)
+    try:
+        late = [missing.send_advice(adviceFactory("true")) for _ in range(3)]
+        assert client.send_and_receive(adviceFactory("true"),
+                                       timeout=1).error_code == 0
+        time.sleep(0.5)
+        assert not any(future.done() for future in late)
+        missing.start()
+        for future in late:
+            assert future.result(timeout=5).error_code == 0
+    finally:
+        client.close()
+        missing.close()
+        daemon.close()
+
+
+def test_subscribing_twice_answers_once():
+    daemon = ClientDaemon()
+    subscribe = adviceFactory("group", type="subscribe")
+    daemon._subscribe(subscribe, b"client")
+    daemon._subscribe(subscribe, b"client")
+    assert daemon._topic_peers == {b"group": [b"client"]}
+    daemon._subscribe(adviceFactory("group", type="unsubscribe"), b"client")
+    assert not daemon._topic_peers
+    daemon.context.term()
+
+
+def test_inproc_daemon_runs_on_the_shared_context():
+    ports = {"advice_port": 27960, "rant_port": 27961,
+             "broadcast_port": 27962}
+    daemon = ClientDaemon(protocol="inproc", host=None, **ports)
+    daemon.start()
+    client = Client("local", "", "", protocol="inproc", **ports)
+    try:
+        assert client.send_and_receive(adviceFactory("true"),
+                                       timeout=5).error_code == 0
+    finally:
+        client.close()
+        daemon.close()
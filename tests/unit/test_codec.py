@@ -0,0 +1,64 @@
+import simplejson
+import zmq
+
+from therapyst.codec import CODECS, codec_for, decode_rant, split_envelope
+from therapyst.data import adviceFactory, rantFactory, bulkAdviceFactory, \
+    bulkRantFactory, RantChunk
+
+
+def test_framed_rant_keeps_payload_out_of_envelope():
+    advice = adviceFactory("cat big")
+    rant = rantFactory(b"\x00\xff" * 1024, 0, advice)
+    frames = CODECS["framed"].encode(rant)
+    assert len(frames) == 2
+    assert len(frames[0]) < 512
+    decoded = decode_rant([zmq.Frame(frame) for frame in frames])
+    assert decoded == rant
+
+
+def test_framed_bulk_rant_round_trip():
+    bulk = bulkAdviceFactory([adviceFactory("ls"), adviceFactory("pwd")])
+    rant = bulkRantFactory([rantFactory(b"out", 0, bulk.advices[0]),
+                            rantFactory("err", 1, bulk.advices[1])], bulk)
+    assert decode_rant(CODECS["framed"].encode(rant)) == rant
+
+
+def test_codec_is_recognized_from_message():
+    rant = rantFactory("heartbeat_reply", 0, adviceFactory(type="heartbeat"))
+    for codec in CODECS.values():
+        assert codec_for(codec.encode(rant)) is codec
+
+
+def test_split_envelope():
+    envelope, body = split_envelope([b"peer", b"", b"F{}", b"payload"])
+    assert envelope == [b"peer", b""]
+    assert body == [b"F{}", b"payload"]
+
+
+def test_rant_chunk_round_trip():
+    advice = adviceFactory("journalctl", stream=True)
+    chunk = RantChunk(b"\xe2\x82", 3, advice, advice.id)
+    assert decode_rant(CODECS["framed"].encode(chunk)) == chunk
+    decoded = decode_rant(CODECS["json"].encode(chunk))
+    assert isinstance(decoded, RantChunk)
+    assert decoded.seq == 3
+    assert decoded.result == b"\xe2\x82"
+    assert decoded.advice.stream
+
+
+def test_character_split_between_chunks_survives_json():
+    advice = adviceFactory("journalctl", stream=True)
+    data = "café".encode("utf-8")
+    chunks = [RantChunk(part, seq, advice, advice.id)
+              for seq, part in enumerate((data[:-1], data[-1:]))]
+    received = b"".join(decode_rant(CODECS["json"].encode(chunk)).result
+                        for chunk in chunks)
+    assert received.decode("utf-8") == "café"
+    rant = decode_rant(CODECS["json"].encode(rantFactory(data, 0, advice)))
+    assert rant.result == "café"
+
+
+def test_complete_results_stay_plain_text_over_json():
+    rant = rantFactory(b"x" * 100, 0, adviceFactory("uptime"))
+    frame = CODECS["json"].encode(rant)[0]
+    assert simplejson.loads(frame)["result"] == "x" * 100
@@ -0,0 +1,25 @@
+from therapyst.codec import CODECS, decode_rant
+from therapyst.compression import compressionSpec
+from therapyst.data import adviceFactory, rantFactory
+
+
+def test_large_results_are_compressed_on_the_wire():
+    spec = compressionSpec("zlib", threshold=1024)
+    advice = adviceFactory("ps aux", compress=spec)
+    rant = rantFactory(b"root 1 0.0 /sbin/init\n" * 1000, 0, advice)
+    for codec in CODECS.values():
+        sent, received = {}, {}
+        frames = codec.encode(rant, sent)
+        assert sum(len(frame) for frame in frames) < len(rant.result) / 5
+        decoded = decode_rant(frames, received)
+        assert decoded.result in (rant.result, rant.result.decode("utf-8"))
+        assert sent["saved_bytes"] == received["saved_bytes"] > 0
+
+
+def test_small_results_are_left_alone():
+    advice = adviceFactory("uname", compress=compressionSpec("lzma"))
+    rant = rantFactory(b"Linux\n", 0, advice)
+    stats = {}
+    frames = CODECS["framed"].encode(rant, stats)
+    assert frames[1] == b"Linux\n"
+    assert stats["saved_bytes"] == 0
@@ -0,0 +1,70 @@
+import simplejson
+
+from therapyst.data import adviceFactory, rantFactory, bulkAdviceFactory, \
+    bulkRantFactory, adviceFromDict, rantFromDict, AdviceQueue, BulkRant, \
+    PriorityAdviceQueue, HIGH_PRIORITY, LOW_PRIORITY
+
+
+def test_bulk_rant_error_code_is_first_unexpected_failure():
+    bulk = bulkAdviceFactory([adviceFactory("true"),
+                              adviceFactory("false", error_expected=True),
+                              adviceFactory("false"),
+                              adviceFactory("true")])
+    rants = [rantFactory("", code, advice)
+             for code, advice in zip((0, 1, 2), bulk.advices)]
+    rant = bulkRantFactory(rants, bulk)
+    assert rant.error_code == 2
+    assert [r.error_code for r in rant.rants] == [0, 1, 2]
+    assert rant.id == bulk.id
+
+
+def test_bulk_error_expected_covers_every_step():
+    bulk = bulkAdviceFactory([adviceFactory("false"), adviceFactory("true")],
+                             error_expected=True)
+    rants = [rantFactory("", code, advice)
+             for code, advice in zip((1, 0), bulk.advices)]
+    assert bulkRantFactory(rants, bulk).error_code == 0
+
+
+def test_bulk_round_trips_through_json():
+    bulk = bulkAdviceFactory([adviceFactory("ls"), adviceFactory("pwd")])
+    assert adviceFromDict(simplejson.loads(
+        simplejson.dumps(bulk._asdict()))) == bulk
+    rant = bulkRantFactory([rantFactory("out", 0, a) for a in bulk.advices],
+                           bulk)
+    decoded = rantFromDict(simplejson.loads(simplejson.dumps(rant._asdict())))
+    assert isinstance(decoded, BulkRant)
+    assert decoded == rant
+
+
+def test_advice_queue_accepts_bulk_advice():
+    queue = AdviceQueue()
+    queue.put(bulkAdviceFactory([adviceFactory("ls")]))
+    assert queue.get().type == "bulk"
+
+
+def test_priority_queue_serves_urgent_advice_first():
+    queue = PriorityAdviceQueue()
+    scrapes = [adviceFactory("scrape", priority=LOW_PRIORITY, group="logs")
+               for _ in range(3)]
+    deploys = [adviceFactory("deploy", group="web") for _ in range(2)]
+    stop = adviceFactory("stop", priority=HIGH_PRIORITY, group="logs")
+    for advice in scrapes + deploys + [stop]:
+        queue.put(advice)
+    assert queue.get_nowait() is stop
+    assert [queue.get_nowait() for _ in range(2)] == deploys
+    assert [queue.get_nowait() for _ in range(3)] == scrapes
+    assert queue.empty()
+    heartbeat = adviceFactory(type="heartbeat")
+    assert heartbeat.priority < HIGH_PRIORITY
+    assert adviceFromDict(simplejson.loads(simplejson.dumps(stop))) == stop
+
+
+def test_groups_take_turns_within_a_priority():
+    queue = PriorityAdviceQueue()
+    first = [adviceFactory("a", group="a") for _ in range(3)]
+    second = [adviceFactory("b", group="b") for _ in range(2)]
+    for advice in first + second:
+        queue.put(advice)
+    order = [queue.get_nowait() for _ in range(5)]
+    assert order == [first[0], second[0], first[1], second[1], first[2]]
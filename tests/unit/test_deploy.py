@@ -0,0 +1,39 @@
+import io
+import tarfile
+
+from therapyst.deploy import build_manifest, manifest_version, \
+    diff_manifests, build_archive, dump_manifest, load_manifest
+
+
+def make_tree(tmpdir):
+    tmpdir.join("setup.py").write("setup()")
+    pkg = tmpdir.mkdir("therapyst")
+    pkg.join("client.py").write("print('hi')")
+    pkg.mkdir("__pycache__").join("client.cpython-311.pyc").write("junk")
+    tmpdir.mkdir("certs").join("server.key").write("key")
+    return str(tmpdir)
+
+
+def test_manifest_skips_build_artifacts(tmpdir):
+    manifest = build_manifest(make_tree(tmpdir))
+    # The daemon's authenticator loads its keys from certs
+    assert sorted(manifest) == ["certs/server.key", "setup.py",
+                                "therapyst/client.py"]
+    assert load_manifest(dump_manifest(manifest)) == manifest
+
+
+def test_only_changed_files_are_shipped(tmpdir):
+    folder = make_tree(tmpdir)
+    remote = build_manifest(folder)
+    tmpdir.join("therapyst", "client.py").write("print('bye')")
+    tmpdir.join("therapyst", "thera.py").write("")
+    tmpdir.join("setup.py").remove()
+    local = build_manifest(folder)
+    assert manifest_version(local) != manifest_version(remote)
+    changed, removed = diff_manifests(local, remote)
+    assert changed == ["therapyst/client.py", "therapyst/thera.py"]
+    assert removed == ["setup.py"]
+    with tarfile.open(fileobj=io.BytesIO(build_archive(folder, changed))) \
+            as tar:
+        assert tar.getnames() == changed
+    assert diff_manifests(local, local) == ([], [])
@@ -0,0 +1,85 @@
+from concurrent.futures import Future
+
+from therapyst.client import ClientDaemon
+from therapyst.data import adviceFactory, bulkAdviceFactory, rantFactory, \
+    Lanes, TIMEOUT, CANCELLED
+from therapyst.executor import adaptive_pool_size, get_backend, run_shell
+
+
+def test_adaptive_pool_size_is_bounded():
+    assert 2 <= adaptive_pool_size() <= 64
+    assert adaptive_pool_size(per_cpu=0) == 2
+    assert adaptive_pool_size(per_cpu=1000, maximum=8) == 8
+
+
+def test_backend_reports_the_rant():
+    backend = get_backend("thread")(
+        lambda advice: rantFactory("ok", 0, advice), 2)
+    done = Future()
+    backend.submit(adviceFactory("true"), done.set_result)
+    assert done.result(5).result == "ok"
+    backend.shutdown()
+
+
+def test_type_limits_do_not_block_other_types():
+    daemon = ClientDaemon(max_threads=2, type_limits={"bulk": 1})
+    daemon._running = {"bulk": 1}
+    bulk = bulkAdviceFactory([adviceFactory("true")])
+    shell = adviceFactory("true")
+    pending = Lanes()
+    pending.append(bulk)
+    pending.append(shell)
+    assert daemon._next_runnable(pending) is shell
+    assert daemon._next_runnable(pending) is None
+    daemon.context.term()
+
+
+def test_commands_are_killed_at_their_timeout():
+    running = {}
+    advice = adviceFactory("sh -c 'echo started; sleep 30'", timeout=0.2)
+    rant = run_shell(advice, running)
+    assert rant.error_code == TIMEOUT
+    assert rant.result == b"started\n"
+    assert not running
+
+
+def test_asyncio_backend_keeps_output_of_timed_out_commands():
+    backend = get_backend("asyncio")(None, 2, {})
+    done = Future()
+    advice = adviceFactory("sh -c 'echo started; sleep 30'", timeout=0.2)
+    backend.submit(advice, done.set_result)
+    rant = done.result(5)
+    assert rant.error_code == TIMEOUT
+    assert rant.result == b"started\n"
+    assert not backend.running
+    backend.shutdown()
+
+
+def test_cancelled_queued_advice_never_runs():
+    daemon = ClientDaemon(max_threads=1)
+    daemon._backend = get_backend("thread")(daemon._handle_advice, 1)
+    advice = adviceFactory("echo never")
+    daemon._enqueue(advice)
+    assert daemon._cancel(advice.id)
+    assert not daemon._cancel(adviceFactory().id)
+    daemon._running[advice.type] = 1
+    daemon._submit(daemon.advice_queue.get_nowait())
+    rant = daemon.rant_queue.get(timeout=5)
+    assert rant.error_code == CANCELLED
+    assert daemon._running[advice.type] == 0
+    daemon._backend.shutdown()
+    daemon.context.term()
+
+
+def test_finishing_advice_never_waits_for_the_rant_queue():
+    daemon = ClientDaemon(max_threads=1, max_queued=1)
+    daemon._backend = get_backend("thread")(daemon._handle_advice, 1)
+    daemon._put_rant(rantFactory("", 0, adviceFactory(type="heartbeat")))
+    advice = adviceFactory("true")
+    daemon._enqueue(advice)
+    daemon._running[advice.type] = 1
+    daemon._submit(daemon.advice_queue.get_nowait())
+    daemon._backend.shutdown()
+    assert daemon._running[advice.type] == 0
+    assert [rant.advice.type for rant in daemon._overflow] == ["shell"]
+    daemon.context.term()
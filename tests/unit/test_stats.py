@@ -0,0 +1,25 @@
+import pytest
+
+from therapyst.stats import Histogram, LatencyStats
+
+
+def test_histogram_percentiles_are_close():
+    histogram = Histogram()
+    for ms in range(1, 1001):
+        histogram.add(ms / 1000)
+    summary = histogram.summary()
+    assert summary["count"] == 1000
+    assert summary["p50"] == pytest.approx(0.5, rel=0.06)
+    assert summary["p99"] == pytest.approx(0.99, rel=0.06)
+    assert summary["max"] == 1.0
+
+
+def test_latency_stats_merge_stages():
+    first, second = LatencyStats(), LatencyStats()
+    first.record({"run": 0.1, "queue_wait": 0.01})
+    second.record({"run": 0.3})
+    summary = LatencyStats().merge(first).merge(second).summary()
+    assert summary["run"]["count"] == 2
+    assert summary["run"]["max"] == 0.3
+    assert summary["queue_wait"]["count"] == 1
+    assert Histogram().summary()["p50"] is None
@@ -0,0 +1,47 @@
+import time
+
+from therapyst.data import adviceFactory, rantFactory
+from therapyst.store import RantStore
+
+
+def test_store_evicts_by_count_bytes_and_age():
+    advice = adviceFactory("cat log")
+    store = RantStore(max_entries=3, max_bytes=10)
+    store["a"] = rantFactory("aaaa", 0, advice)
+    store["b"] = rantFactory("bbbb", 0, advice)
+    assert store["a"].result == "aaaa"
+    store["c"] = rantFactory("cccc", 0, advice)
+    assert "b" not in store
+    assert "a" in store and "c" in store
+    assert store.stats["bytes"] == 8
+    store.put("d", rantFactory("", 0, advice), ttl=0.05)
+    time.sleep(0.1)
+    assert store.get("d") is None
+    assert store.pop("a").result == "aaaa"
+    assert len(store) == 1
+    assert store.stats["evictions"] == 1
+    assert store.stats["expired"] == 1
+
+
+def test_large_results_spill_to_disk(tmp_path):
+    advice = adviceFactory("cat log")
+    store = RantStore(max_bytes=100, spill_dir=str(tmp_path),
+                      spill_threshold=10)
+    big = b"x" * 1000
+    for i in range(20):
+        store[i] = rantFactory(big, 0, advice)
+    store["text"] = rantFactory("y" * 50, 0, advice)
+    store["small"] = rantFactory("ok", 0, advice)
+    assert store.stats["spilled"] == 21
+    assert store.stats["spilled_bytes"] == 20050
+    assert store.stats["bytes"] == 2
+    assert store[3].result == big
+    assert store["text"].result == "y" * 50
+    for i in range(19):
+        assert store.pop(i).result == big
+    # Most of the log is dead by now so it was compacted
+    assert store._log.size < 20050
+    assert store.pop(19).result == big
+    assert store["text"].result == "y" * 50
+    assert not list(tmp_path.iterdir())
+    store.close()
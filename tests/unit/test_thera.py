@@ -0,0 +1,220 @@
+import time
+
+from collections import namedtuple
+from concurrent.futures import Future
+
+import pytest
+
+from therapyst.client import Client, ClientDaemon
+from therapyst.data import adviceFactory, rantFactory
+from therapyst.stats import LatencyStats
+from therapyst.thera import GroupFuture, TherapyGroup, Therapyst
+
+Member = namedtuple("Member", "name")
+
+
+def group_future(count):
+    advice = adviceFactory("uptime")
+    futures = {Member("m{}".format(i)): Future() for i in range(count)}
+    return advice, futures, GroupFuture(advice, futures)
+
+
+def test_gather_returns_at_quorum_with_stragglers():
+    advice, futures, group = group_future(4)
+    for member in list(futures)[:3]:
+        futures[member].set_result(rantFactory("up", 0, advice))
+    heard = group.gather(quorum=0.75, timeout=1)
+    assert sorted(heard.rants) == ["m0", "m1", "m2"]
+    assert heard.stragglers == ["m3"]
+    assert not group.done()
+
+
+def test_gather_deadline_and_late_rants():
+    advice, futures, group = group_future(2)
+    members = list(futures)
+    futures[members[0]].set_result(rantFactory("up", 0, advice))
+    heard = group.gather(timeout=0.05)
+    assert heard.stragglers == ["m1"]
+    with pytest.raises(TimeoutError):
+        group.gather(timeout=0.05, raise_on_timeout=True)
+    futures[members[1]].set_exception(IOError("gone"))
+    heard = group.gather(timeout=0.05)
+    assert heard.stragglers == []
+    assert list(heard.errors) == ["m1"]
+    assert group.done()
+
+
+class InstallMember():
+
+    def __init__(self, name, fail=False):
+        self.name = name
+        self.fail = fail
+
+    def install_and_start_daemon(self, wheelhouse=None):
+        if self.fail:
+            raise EnvironmentError("virtualenv package in required")
+
+
+def test_install_summary_reports_failures():
+    group = TherapyGroup([InstallMember("ok1"), InstallMember("bad", True),
+                          InstallMember("ok2")])
+    summary = group.install_and_start_daemons(max_workers=2)
+    assert sorted(summary.succeeded) == ["ok1", "ok2"]
+    assert list(summary.failed) == ["bad"]
+    assert set(summary.durations) == {"ok1", "ok2", "bad"}
+    with pytest.raises(EnvironmentError):
+        group.install_and_start_daemons(raise_on_error=True)
+
+
+class WatchedMember():
+
+    def __init__(self, name, last_seen):
+        self.name = name
+        self.last_seen = last_seen
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_member_watch_marks_silent_members_down():
+    now = time.time()
+    alive, silent = WatchedMember("alive", now), WatchedMember("silent", None)
+    group = TherapyGroup([alive, silent], member_timeout=5,
+                         raise_on_timeout=True)
+    advice = adviceFactory("uptime")
+    futures = {alive: Future(), silent: Future()}
+    group._group_futures[advice.id] = GroupFuture(advice, futures)
+    group._member_seen = {alive: now - 10, silent: now - 10}
+    group._member_watch()
+    group.close()
+    assert alive.closed and silent.closed
+    assert list(group.down) == [silent]
+    assert isinstance(futures[silent].exception(), EnvironmentError)
+    assert not futures[alive].done()
+    silent.last_seen = time.time() + 1
+    group.stop = False
+    group._member_watch()
+    group.close()
+    assert not group.down
+
+
+class CancelledMember(WatchedMember):
+
+    def __init__(self, name):
+        super().__init__(name, None)
+        self.cancelled = []
+
+    def cancel(self, advice, block=True):
+        self.cancelled.append(advice.id)
+
+
+def test_cancel_reaches_only_members_yet_to_rant():
+    ranted, straggler = CancelledMember("ranted"), CancelledMember("late")
+    group = TherapyGroup([ranted, straggler])
+    advice = adviceFactory("uptime")
+    futures = {ranted: Future(), straggler: Future()}
+    futures[ranted].set_result(rantFactory("up", 0, advice))
+    group._group_futures[advice.id] = GroupFuture(advice, futures)
+    group.cancel(advice)
+    assert (ranted.cancelled, straggler.cancelled) == ([], [advice.id])
+    # Once every member has ranted there is nothing left to cancel
+    del group._group_futures[advice.id]
+    group.cancel(advice)
+    assert straggler.cancelled == [advice.id]
+
+
+class DownMember(WatchedMember):
+
+    def __init__(self, name):
+        super().__init__(name, None)
+        self.latency = LatencyStats()
+
+    def send_advice(self, advice, block=True):
+        pass
+
+    def get_rant(self, advice, block=True, timeout=None):
+        raise EnvironmentError("member down")
+
+
+def test_stats_reports_failed_members_under_their_name():
+    group = TherapyGroup([DownMember("down")])
+    stats = group.stats(daemons=True, timeout=1)
+    assert stats["members"]["down"]["daemon"] == {"error": "member down"}
+
+
+def test_therapyst_advises_shared_hosts_once():
+    host = {"ip": "10.0.0.1", "username": "user", "password": "pass"}
+    other = dict(host, ip="10.0.0.2")
+    therapyst = Therapyst({"web": {"web1": host, "web2": other},
+                           "db": {"primary": host}})
+    assert len(therapyst.clients) == 2
+    advice = adviceFactory("uptime")
+    group_future = therapyst.give_advice(advice, ["web", "db"])
+    assert len(group_future.futures) == 2
+    assert therapyst.fleet._advice_queues[
+        therapyst.groups["db"]["primary"]].qsize() == 1
+    for client in therapyst.clients.values():
+        client._deliver_rant(rantFactory(client.ip, 0, advice))
+    # Only the routing is remembered, the rants live in the fleet's store
+    assert therapyst._routes[advice.id] == ["web", "db"]
+    assert not therapyst.fleet._group_futures
+    assert len(therapyst.fleet.rants) == 2
+    heard = therapyst.hear_rant(advice, timeout=1)
+    assert heard["db"]["primary"].result == "10.0.0.1"
+    assert heard["web"]["web1"] is heard["db"]["primary"]
+    assert heard["web"]["web2"].result == "10.0.0.2"
+    with pytest.raises(ValueError):
+        therapyst.give_advice(advice, "mail")
+
+
+def test_groups_sharing_a_daemon_each_hear_their_rants():
+    ports = {"advice_port": 28100, "rant_port": 28101,
+             "broadcast_port": 28102}
+    daemon = ClientDaemon(host="127.0.0.1", max_threads=4, **ports)
+    daemon.start()
+    groups = [TherapyGroup([Client("127.0.0.1", "", "", name=name,
+                                   **ports)],
+                           name=name, broadcast=broadcast)
+              for name, broadcast in (("a", True), ("b", False))]
+    try:
+        for group in groups:
+            group.start()
+        given = [(group, group.give_advice(adviceFactory("echo {}".format(
+            group.name)))) for _ in range(10) for group in groups]
+        for group, group_future in given:
+            rants = group_future.result(timeout=10)
+            assert [rant.result.strip() for rant in rants.values()] == \
+                [group.name]
+    finally:
+        for group in groups:
+            group.close()
+        daemon.close()
+
+
+def test_members_added_to_a_running_group_get_advice():
+    ports = [{"advice_port": port, "rant_port": port + 1,
+              "broadcast_port": port + 2} for port in (28110, 28113)]
+    daemons = [ClientDaemon(host="127.0.0.1", max_threads=4, **spec)
+               for spec in ports]
+    for daemon in daemons:
+        daemon.start()
+    groups = [TherapyGroup([Client("127.0.0.1", "", "", name="first",
+                                   **ports[0])], broadcast=broadcast)
+              for broadcast in (True, False)]
+    try:
+        for group in groups:
+            group.start()
+            group.add_member(Client("127.0.0.1", "", "", name="added",
+                                    **ports[1]))
+        # Subscribed, probed and now published to like the first member
+        assert len(groups[0]._subscribed) == 2
+        for group in groups:
+            rants = group.give_advice(adviceFactory("echo hi")).result(
+                timeout=10)
+            assert sorted(rants) == ["added", "first"]
+    finally:
+        for group in groups:
+            group.close()
+        for daemon in daemons:
+            daemon.close()
@@ -0,0 +1,14 @@
+import pytest
+
+from therapyst.transport import endpoint, IPC_DIR
+
+
+def test_endpoints():
+    assert endpoint("tcp", "10.0.0.1", 5557) == "tcp://10.0.0.1:5557"
+    assert endpoint("ipc", "127.0.0.1", 5557) == \
+        "ipc://{}/therapyst-5557".format(IPC_DIR)
+    assert endpoint("ipc", "/run/therapyst", 5557) == \
+        "ipc:///run/therapyst/therapyst-5557"
+    assert endpoint("inproc", "anything", 5557) == "inproc://therapyst-5557"
+    with pytest.raises(ValueError):
+        endpoint("udp", "10.0.0.1", 5557)
@@ -0,0 +1,373 @@
+#!/usr/bin/env python
+
+import asyncio
+import logging
+import time
+
+from uuid import uuid4
+
+import zmq
+import zmq.asyncio
+from zmq.auth.asyncio import AsyncioAuthenticator
+
+from therapyst.client import Client, CERTS_DIR
+from therapyst.codec import split_envelope
+from therapyst.data import adviceFactory, RantChunk
+from therapyst.poller import shared_context, shared_authenticator
+from therapyst.transport import endpoint
+
+LOG = logging.getLogger(__name__)
+
+
+class AsyncClient(Client):
+
+    """
+    asyncio flavor of Client.
+
+    The advice channel, rant listener, heartbeat and authenticator all run
+    as tasks on the event loop that called start(), so any number of
+    AsyncClients cost no extra OS threads.  SSH bootstrap methods are
+    inherited from Client and are still blocking.
+
+    max_outstanding and overload bound the advice awaiting a rant as in
+    Client, see take_credit.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._sync_context = self.context
+        self.context = zmq.asyncio.Context(shadow=self.context)
+        self._tasks = []
+        self._acks = {}
+        self._window = None
+
+    async def start(self):
+        LOG.debug("Starting AsyncClient tasks")
+        self._window = asyncio.Semaphore(self.max_in_flight)
+        self._credits = asyncio.Semaphore(self.max_outstanding)
+        self._advice_socket = self._get_socket(zmq.DEALER)
+        self._advice_socket.setsockopt(zmq.LINGER, 0)
+        self._advice_socket.setsockopt(zmq.IDENTITY, self.identity)
+        self._advice_socket.connect(endpoint(self.protocol, self.ip,
+                                             self.advice_port))
+        self._tasks = [asyncio.ensure_future(coro) for coro in (
+            self._ack_listener(),
+            self.rant_listener_func(),
+            self.run_heartbeat())]
+        self._setup_auth_thread()
+        self.ready = True
+        return self.ready
+
+    async def close(self):
+        self.stop = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.auth_thread and self._sync_context is not shared_context():
+            self.auth_thread.stop()
+        if self._advice_socket:
+            self._advice_socket.close()
+            self._advice_socket = None
+        self.ready = False
+
+    async def send_advice(self, advice, block=True):
+        """
+        Pipelined send, at most max_in_flight unacknowledged advice.
+        Advice not acked within ack_timeout fails its Future with an
+        IOError, which is also raised when blocking.
+        Returns an asyncio Future completed with the Rant when it arrives
+        """
+        if not self.ready:
+            await self.start()
+        advice = self._prepare_advice(advice)
+        await self.take_credit(advice)
+        future = self.expect_rant(advice)
+        await self._window.acquire()
+        self.mark_sent(advice)
+        loop = asyncio.get_event_loop()
+        ack = self._acks[advice.id] = loop.create_future()
+        timer = loop.call_later(self.ack_timeout, self._ack_timed_out,
+                                advice.id)
+        ack.add_done_callback(lambda _: timer.cancel())
+        LOG.debug("Sending adviceFactory: {}".format(advice))
+        await self._advice_socket.send_multipart(
+            [b""] + self.codec.encode(advice), copy=False)
+        if block:
+            try:
+                await ack
+            except IOError:
+                if future.done():
+                    # Raised to the caller here, so not left unretrieved
+                    future.exception()
+                raise
+        return future
+
+    async def take_credit(self, advice):
+        """
+        Like Client.take_credit, waiting on the event loop rather than
+        blocking it
+        """
+        if advice.id in self._credited:
+            return
+        try:
+            if self.overload == "reject" and self._credits.locked():
+                raise asyncio.TimeoutError()
+            await asyncio.wait_for(self._credits.acquire(), self.ack_timeout)
+        except asyncio.TimeoutError:
+            raise IOError("Client {} already has {} advice "
+                          "outstanding".format(self.name,
+                                               self.max_outstanding)) from None
+        self._credited.add(advice.id)
+        self.expect_rant(advice).add_done_callback(
+            lambda future: self._return_credit(advice.id))
+
+    def _ack_timed_out(self, advice_id):
+        ack = self._acks.pop(advice_id, None)
+        if ack is None or ack.done():
+            return
+        # A late ack finds nothing to release, the permit is returned here
+        self._window.release()
+        error = IOError("No ack from Client {} after {} seconds".format(
+            self.name, self.ack_timeout))
+        self._fail_advice([advice_id], error)
+        ack.set_exception(error)
+        # Only a blocking send_advice waits for the ack
+        ack.exception()
+
+    async def send_and_receive(self, advice, timeout=None):
+        await self.send_advice(advice)
+        return await self.get_rant(advice, timeout=timeout)
+
+    def expect_rant(self, advice):
+        if getattr(advice, "stream", False):
+            self._streams.setdefault(advice.id, asyncio.Queue())
+        future = self._futures.get(advice.id)
+        if not future:
+            future = self._futures[advice.id] = \
+                asyncio.get_event_loop().create_future()
+            if advice.id in self.rants:
+                future.set_result(self.rants[advice.id])
+            else:
+                self._queued_at.setdefault(advice.id, time.time())
+                future.add_done_callback(
+                    lambda future: self._forget_sent(advice.id))
+        return future
+
+    def _deliver_rant(self, rant):
+        if isinstance(rant, RantChunk):
+            self._streams.setdefault(rant.id, asyncio.Queue()).put_nowait(rant)
+            return
+        stream = self._streams.pop(rant.id, None)
+        if stream:
+            stream.put_nowait(None)
+        self.rants[rant.id] = rant
+        future = self._futures.pop(rant.id, None)
+        if future and not future.done():
+            future.set_result(rant)
+
+    async def iter_rant(self, advice, timeout=None):
+        """
+        Async iterator over the output chunks (bytes) of a streaming advice
+        """
+        self.expect_rant(advice)
+        stream = self._streams.get(advice.id)
+        if not stream:
+            return
+        while True:
+            chunk = await asyncio.wait_for(stream.get(), timeout)
+            if chunk is None:
+                return
+            yield chunk.result
+
+    async def get_rant(self, advice, timeout=None):
+        if advice.id not in self.rants:
+            await asyncio.wait_for(asyncio.shield(self.expect_rant(advice)),
+                                   timeout)
+        self._futures.pop(advice.id, None)
+        return self.rants.pop(advice.id)
+
+    async def _ack_listener(self):
+        while not self.stop:
+            frames = await self._advice_socket.recv_multipart()
+            advice_id = frames[-1].decode("utf-8")
+            self.last_seen = time.time()
+            LOG.debug("Recived ack: {}".format(advice_id))
+            ack = self._acks.pop(advice_id, None)
+            if ack:
+                self._window.release()
+                if not ack.done():
+                    ack.set_result(True)
+
+    async def rant_listener_func(self):
+        socket = self._get_socket(zmq.DEALER)
+        socket.setsockopt(zmq.IDENTITY, self.identity)
+        socket.connect(endpoint(self.protocol, self.ip, self.rant_port))
+        try:
+            while not self.stop:
+                envelope, frames = split_envelope(
+                    await socket.recv_multipart(copy=False))
+                rant = self._record_timings(self._frames_to_pyobj(
+                    frames, self.compression_stats))
+                self.last_seen = time.time()
+                LOG.debug("Recieved rant: {}".format(rant.id))
+                await socket.send_multipart(envelope + [
+                    "Recieved rant: {}".format(rant.id).encode("utf-8")])
+                self._deliver_rant(rant)
+        finally:
+            socket.close(linger=0)
+
+    def _heartbeat_socket(self):
+        socket = self._get_socket(zmq.REQ)
+        socket.setsockopt(zmq.LINGER, 0)
+        socket.connect(endpoint(self.protocol, self.ip, self.advice_port))
+        return socket
+
+    async def run_heartbeat(self):
+        socket = self._heartbeat_socket()
+        try:
+            while not self.stop:
+                await asyncio.sleep(self.heartbeat_interval)
+                if self.last_seen and \
+                        time.time() - self.last_seen < self.heartbeat_interval:
+                    # Acks and rants already prove the daemon is alive
+                    self.heartbeat = True
+                    self.heartbeats_suppressed += 1
+                    continue
+                heartbeat = adviceFactory("", "", "heartbeat")
+                await socket.send_multipart(self.codec.encode(heartbeat))
+                self.heartbeats_sent += 1
+                if not await socket.poll(self.heartbeat_interval * 1000):
+                    # A REQ socket is stuck until it gets a reply, start over
+                    self.heartbeat = False
+                    socket.close()
+                    socket = self._heartbeat_socket()
+                    continue
+                rant = self._frames_to_pyobj(
+                    await socket.recv_multipart(copy=False))
+                self.heartbeat = rant.result == "heartbeat_reply"
+                if self.heartbeat:
+                    self.last_seen = time.time()
+        finally:
+            socket.close()
+
+    def _setup_auth_thread(self):
+        if self._sync_context is shared_context():
+            self.auth_thread = shared_authenticator(CERTS_DIR)
+            return
+        self.auth_thread = AsyncioAuthenticator(self.context)
+        self.auth_thread.start()
+        self.auth_thread.allow('172.0.0.1')
+        self.auth_thread.configure_curve(domain="*", location=CERTS_DIR)
+
+
+class AsyncTherapyGroup():
+
+    """
+    asyncio flavor of TherapyGroup.  Advice is sent to every member
+    concurrently from the event loop, no per-member threads are used
+
+        group = AsyncTherapyGroup.from_dict(clients)
+        await group.start()
+        await group.give_advice(advice)
+        async for name, rant in group.rants(advice):
+            ...
+    """
+
+    def __init__(self, members, name=None, member_timeout=30,
+                 raise_on_timeout=False):
+        self.name = name if name else uuid4()
+        self.members = members
+        self.stop = False
+        self.member_watch_task = None
+        self._member_timeout = member_timeout
+        self._raise_on_timeout = raise_on_timeout
+
+    def add_member(self, new_member):
+        self.members.append(new_member)
+
+    def remove_member(self, member_name):
+        self.members = [member for member in self.members
+                        if member.name != member_name]
+
+    @property
+    def heartbeats(self):
+        return [(member, member.heartbeat) for member in self.members]
+
+    def __contains__(self, key):
+        return key in self.members
+
+    @classmethod
+    def from_dict(cls, data_struct, name=None):
+        """
+            {
+             client_name1: {"ip": 1.1.1.1,
+                            "username", myuser,
+                            "password": mypass},
+             client_name2: {"ip": 1.1.1.2,
+                            "username": myuser,
+                            "password": mypass}
+            }
+        """
+        clients = [AsyncClient(c['ip'], c['username'], c['password'], name=n)
+                   for n, c in data_struct.items()]
+        return cls(clients, name=name)
+
+    async def start(self):
+        await asyncio.gather(*(member.start() for member in self.members))
+        self.member_watch_task = asyncio.ensure_future(self._member_watch())
+
+    async def close(self):
+        self.stop = True
+        if self.member_watch_task:
+            self.member_watch_task.cancel()
+        await asyncio.gather(*(member.close() for member in self.members))
+
+    async def _member_watch(self):
+        """
+        Auto restart client daemon processes on remote machines based
+        on heartbeats
+        """
+        loop = asyncio.get_event_loop()
+        member_watch = {member: time.time() for member in self.members}
+        while not self.stop:
+            await asyncio.sleep(min(self._member_timeout, 1))
+            for member, heartbeat in self.heartbeats:
+                last_seen = member_watch.setdefault(member, time.time())
+                if heartbeat:
+                    member_watch[member] = time.time()
+                elif time.time() - last_seen >= self._member_timeout:
+                    if self._raise_on_timeout:
+                        raise EnvironmentError(
+                            "Member: {} of TherapyGroup: {} timed out after "
+                            "{} seconds of not responding to heartbeat "
+                            "requests".format(member, self.name,
+                                              time.time() - last_seen))
+                    await loop.run_in_executor(None, member.start_daemon)
+                    member_watch[member] = time.time()
+
+    async def give_advice(self, advice):
+        """
+        Send advice to every member, returns once all of them acked
+        """
+        if advice.group is None:
+            advice = advice._replace(group=str(self.name))
+        await asyncio.gather(*(member.send_advice(advice)
+                               for member in self.members))
+
+    async def hear_rant(self, advice, timeout=None):
+        rants = await asyncio.wait_for(
+            asyncio.gather(*(member.get_rant(advice)
+                             for member in self.members)), timeout)
+        return {member.name: rant
+                for member, rant in zip(self.members, rants)}
+
+    async def rants(self, advice, timeout=None):
+        """
+        Async iterator of (member name, rant) in the order they arrive
+        """
+        async def named(member):
+            return member.name, await member.get_rant(advice)
+        for coro in asyncio.as_completed(
+                [named(member) for member in self.members], timeout=timeout):
+            yield await coro
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+"""
+Bounded stores of Rants kept by the ClientDaemon.
+
+Recent rants are remembered by advice id so advice delivered twice (eg.
+resent after a reconnect) is answered without running it again, and
+advice with a cache TTL is answered from an earlier run of the same
+command while that is fresh.
+"""
+
+import threading
+
+from collections import OrderedDict
+from time import time
+
+from therapyst.store import result_size, MIB
+
+
+class ResultCache():
+
+    """
+    LRU of at most max_entries rants holding at most max_bytes of results,
+    each optionally expiring after a TTL.  A rant bigger than max_bytes on
+    its own isn't kept at all.  Counts hits, misses, evictions and the
+    result bytes held in stats
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=32 * MIB):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] is not None and entry[0] <= time():
+                self._remove(key)
+                entry = None
+            self.stats["hits" if entry else "misses"] += 1
+            if not entry:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, rant, ttl=None):
+        size = result_size(rant)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (time() + ttl if ttl else None, rant, size)
+            self.stats["bytes"] += size
+            while len(self._entries) > self.max_entries or \
+                    self.stats["bytes"] > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.stats["evictions"] += 1
+
+    def _remove(self, key):
+        self.stats["bytes"] -= self._entries.pop(key)[2]
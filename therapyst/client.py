@@ -1,26 +1,46 @@
 #!/usr/bin/env python
 
+import io
 import sys
 import argparse
 import os
+import signal
 import subprocess
 import shlex
 import logging
 import socket as sckt
 
 
+from collections import OrderedDict, deque
+from itertools import count
+from concurrent.futures import Future
 from uuid import uuid4
-from time import sleep, time
+from time import time
 import errno
+import queue
 import threading
 
 import zmq
 import zmq.auth
 import paramiko
-import simplejson
 from zmq.auth.thread import ThreadAuthenticator
 
-from therapyst.data import adviceFactory, rantFactory, AdviceQueue, RantQueue
+from therapyst.data import adviceFactory, rantFactory, bulkRantFactory, \
+    PriorityAdviceQueue, PriorityRantQueue, Lanes, RantChunk, TIMEOUT, \
+    CANCELLED, REJECTED
+from therapyst.codec import CODECS, get_codec, codec_for, decode_rant, \
+    split_envelope
+from therapyst.cache import ResultCache
+from therapyst.compression import compressionSpec
+from therapyst.executor import adaptive_pool_size, get_backend, kill_group, \
+    run_shell, MAX_POOL_SIZE
+from therapyst.deploy import build_manifest, manifest_version, \
+    diff_manifests, build_archive, dump_manifest, load_manifest
+from therapyst.poller import shared_context, shared_authenticator, \
+    shared_poller
+from therapyst.stats import LatencyStats
+from therapyst.store import RantStore, MIB
+from therapyst.transport import endpoint, bind_endpoint, PROTOCOLS
 
 LOG = logging.getLogger(__name__)
 logging.getLogger("paramiko").setLevel(logging.WARNING)
@@ -28,12 +48,17 @@ logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
 RANT_DEFAULT_PORT = 5556
 ADVICE_DEFAULT_PORT = 5557
+BROADCAST_DEFAULT_PORT = 5558
 REMOTE_DIR = "therapyst"
 REMOTE_BINARY = "/".join(("therapyst", os.path.basename(__file__)))
 REMOTE_VENV = "therapyst_venv"
 REMOTE_VENV_PYTHON = os.path.join(REMOTE_VENV, "bin", "python")
 REMOTE_VENV_PIP = os.path.join(REMOTE_VENV, "bin", "pip")
 REMOTE_EXECUTE = os.path.join(REMOTE_DIR, REMOTE_BINARY)
+REMOTE_MANIFEST = os.path.join(REMOTE_DIR, ".therapyst_manifest.json")
+REMOTE_ARCHIVE = "therapyst_deploy.tar.gz"
+REMOTE_WHEELHOUSE = "therapyst_wheelhouse"
+REMOTE_WHEELHOUSE_ARCHIVE = "therapyst_wheelhouse.tar.gz"
 
 LOCAL_FOLDER = os.path.split(os.path.dirname(os.path.abspath(__file__)))[0]
 
@@ -45,6 +70,12 @@ CERTS_DIR = os.path.join(LOCAL_FOLDER, 'certs')
 OS_LINUX = 'linux'
 OS_OTHER = 'other'
 
+# What senders do when there is no room for more advice
+OVERLOAD_POLICIES = ("block", "reject")
+# Seconds a Client may be unreachable on the rant channel before its rants
+# are parked, and between attempts to resend parked rants
+RANT_PEER_GRACE = 5
+
 
 class Client():
 
@@ -60,127 +91,478 @@ class Client():
             name=None,
             rant_port=RANT_DEFAULT_PORT,
             advice_port=ADVICE_DEFAULT_PORT,
+            broadcast_port=BROADCAST_DEFAULT_PORT,
             protocol="tcp",
-            auth=True):
+            auth=True,
+            max_in_flight=100,
+            ack_timeout=30,
+            context=None,
+            codec="json",
+            compression=None,
+            max_outstanding=1000,
+            overload="block",
+            max_rants=10000,
+            rant_store=None):
+        """
+        :param max_outstanding: advice sent but not yet answered, see
+                                take_credit
+        :param overload: "block" or "reject", what to do when
+                         max_outstanding is reached
+        :param max_rants: rants kept for get_rant, the least recently used
+                          are dropped
+        :param rant_store: a RantStore for the rants instead, eg. with a byte
+                           budget or spill_dir.  Keyed by advice id, so
+                           never share one between Clients
+        """
+        if overload not in OVERLOAD_POLICIES:
+            raise ValueError("Unknown overload policy {}, choose from "
+                             "{}".format(overload,
+                                         ", ".join(OVERLOAD_POLICIES)))
         self.ip = ip
         self.username = username
         self.password = password
         self.name = name if name else self._gen_name()
         self.advice_port = advice_port
         self.rant_port = rant_port
+        self.broadcast_port = broadcast_port
         self.protocol = protocol
+        self.codec = get_codec(codec)
+        if isinstance(compression, str):
+            compression = compressionSpec(compression)
+        self.compression = compression
+        self.compression_stats = {}
         self.auth = auth
         self.auth_thread = None
-        self.context = zmq.Context()
+        self.context = context if context else shared_context()
         self.os = None
+        self.deployed_version = None
+        self.install_timings = {}
         self.python_version = None
         self._transport = None
-        self._ssh = None
+        self._sftp = None
+        self._ssh_lock = threading.RLock()
+        self.ssh_stats = {"handshakes": 0, "handshake_time": 0.0,
+                          "sessions": 0, "sftp_channels": 0}
         self.stop = False
         self.ready = False
         self.heartbeat = None
         self.heartbeat_interval = 5
-        self.heartbeater = None
-        self.rant_listener = None
-        self.rants = {}
+        # When the daemon was last heard from, by heartbeat, ack or rant
+        self.last_seen = None
+        self.heartbeats_sent = 0
+        self.heartbeats_suppressed = 0
+        self.poller = None
+        self._rant_socket = None
+        self._heartbeat_socket = None
+        self._heartbeat_timer = None
+        self._heartbeat_pending = False
+        self.rants = rant_store if rant_store is not None else \
+            RantStore(max_entries=max_rants)
+        self.max_outstanding = max_outstanding
+        self.overload = overload
+        self._credits = threading.Semaphore(max_outstanding)
+        self._credited = set()
+        self._futures = {}
+        self._streams = {}
+        self._rant_lock = threading.Lock()
+        # Per stage latency of the rants heard, see therapyst.stats
+        self.latency = LatencyStats()
+        self._queued_at = {}
+        self._sent_at = {}
+        self.max_in_flight = max_in_flight
+        self.ack_timeout = ack_timeout
+        self._advice_socket = None
+        self._advice_lock = threading.Lock()
+        self._in_flight = OrderedDict()
+        # Routing id of both our advice and rant sockets, the daemon sends
+        # the rant of advice back to the Client that gave it
+        self.identity = uuid4().hex.encode("ascii")
 
     def _get_socket(self, socket_type):
         return self.context.socket(socket_type)
 
-    def _str_to_pyobj(self, string):
-        json = simplejson.loads(string)
-        return rantFactory(json["result"],
-                           json["error_code"],
-                           adviceFactory(json["advice"]["cmd"],
-                                         json["advice"]["error_expected"],
-                                         json["advice"]["type"],
-                                         json["advice"]["id"]))
+    def _get_advice_socket(self):
+        """
+        Persistent DEALER socket shared by every advice sent to this Client.
+        Callers must hold self._advice_lock
+        """
+        if not self._advice_socket:
+            socket = self._get_socket(zmq.DEALER)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.setsockopt(zmq.SNDHWM, self.max_outstanding)
+            socket.setsockopt(zmq.IDENTITY, self.identity)
+            socket.connect(endpoint(self.protocol, self.ip, self.advice_port))
+            self._advice_socket = socket
+        return self._advice_socket
+
+    def _reset_advice_socket(self):
+        if self._advice_socket:
+            self._advice_socket.close()
+        self._advice_socket = None
+        self._in_flight.clear()
+
+    def _recv_ack(self, timeout=None):
+        """
+        Receive a single ack from the daemon and retire the advice it
+        belongs to.  Returns the acknowledged advice id.
+        Callers must hold self._advice_lock
+        """
+        socket = self._get_advice_socket()
+        if timeout is None:
+            timeout = self.ack_timeout
+        if not socket.poll(timeout * 1000):
+            in_flight = list(self._in_flight)
+            self._reset_advice_socket()
+            error = IOError("No ack from Client {} after {} seconds, dropped "
+                            "{} in-flight advice".format(self.name, timeout,
+                                                         len(in_flight)))
+            self._fail_advice(in_flight, error)
+            raise error
+        advice_id = socket.recv_multipart()[-1].decode("utf-8")
+        self.last_seen = time()
+        self._in_flight.pop(advice_id, None)
+        LOG.debug("Recived ack: {}".format(advice_id))
+        return advice_id
+
+    def _fail_advice(self, advice_ids, error):
+        """
+        Fail the Futures of advice that will never be answered, which also
+        returns their credits
+        """
+        with self._rant_lock:
+            futures = [self._futures.pop(advice_id, None)
+                       for advice_id in advice_ids]
+        for future in futures:
+            if future and not future.done():
+                future.set_exception(error)
+
+    def _frames_to_pyobj(self, frames, stats=None):
+        return decode_rant(frames, stats)
+
+    def _prepare_advice(self, advice):
+        """
+        Apply this Client's default compression to advice that doesn't
+        ask for its own
+        """
+        if self.compression and getattr(advice, "compress", True) is None:
+            advice = advice._replace(compress=self.compression)
+        return advice
 
     def start(self):
-        LOG.debug("Starting Client Threads")
-        self.heartbeater = threading.Thread(
-            name="heartbeater", target=self.run_heartbeat)
-        self.heartbeater.daemon = True
-        self.heartbeater.start()
-        LOG.debug("Heartbeater started")
-        self.rant_listener = threading.Thread(
-            name="rant_listener", target=self.rant_listener_func)
-        self.rant_listener.daemon = True
-        self.rant_listener.start()
-        LOG.debug("rant_listener started")
+        """
+        Rant and heartbeat sockets are serviced by the process wide poller
+        thread rather than by threads of our own
+        """
+        LOG.debug("Starting Client {}".format(self.name))
         self._setup_auth_thread()
         LOG.debug("auth_thread started")
+        self.poller = shared_poller()
+        self.poller.call_soon(self._start_io)
         self.ready = True
         return self.ready
 
-    def send_advice(self, advice):
+    def close(self):
+        self.stop = True
+        if self.poller:
+            self.poller.call_soon(self._stop_io)
+        with self._advice_lock:
+            self._reset_advice_socket()
+        self.ready = False
+
+    def _start_io(self):
+        # DEALER as the daemon's rant socket is a ROUTER, which zmq won't
+        # pair with a REP.  Each rant is answered like a REP would
+        self._rant_socket = self._get_socket(zmq.DEALER)
+        self._rant_socket.setsockopt(zmq.LINGER, 0)
+        self._rant_socket.setsockopt(zmq.IDENTITY, self.identity)
+        self._rant_socket.connect(endpoint(self.protocol, self.ip,
+                                           self.rant_port))
+        self.poller.register(self._rant_socket, self._on_rant)
+        self._heartbeat_timer = self.poller.call_later(
+            self.heartbeat_interval, self._send_heartbeat)
+
+    def _stop_io(self):
+        if self._heartbeat_timer:
+            self._heartbeat_timer.cancel()
+        for socket in (self._rant_socket, self._heartbeat_socket):
+            if socket:
+                self.poller.unregister(socket)
+                socket.close()
+        self._rant_socket = self._heartbeat_socket = None
+
+    def send_advice(self, advice, block=True):
         """
         Used for Async sending
+
+        Advice is pipelined over a persistent DEALER socket, up to
+        max_in_flight unacknowledged advice at once.  With block=False this
+        returns as soon as the advice is queued on the socket, otherwise it
+        waits for the daemon to acknowledge this advice.
+
+        Returns a Future which is completed with the Rant when it arrives
         """
         if not self.ready:
             self.start()
-        socket = self._get_socket(zmq.REQ)
-        socket.connect("{}://{}:{}".format(self.protocol,
-                                           self.ip,
-                                           self.advice_port))
-        socket.send_unicode(simplejson.dumps(advice._asdict()))
-        LOG.debug("Sending adviceFactory: {}".format(advice))
-        resp = socket.recv_unicode()
-        LOG.debug("Recived Response: {}".format(resp))
-        if advice.id in resp:
-            return True
-        else:
-            return False
+        advice = self._prepare_advice(advice)
+        future = self.expect_rant(advice)
+        try:
+            self.take_credit(advice)
+            self.mark_sent(advice)
+            self._send(advice, block)
+        except IOError as e:
+            self._fail_advice([advice.id], e)
+            if not future.done():
+                future.set_exception(e)
+            raise
+        return future
 
-    def send_and_receive(self, advice):
-        if not self.send_advice(advice):
-            raise IOError("Error occurred during communication with client")
+    def take_credit(self, advice):
+        """
+        Every advice sent holds one of max_outstanding credits until its
+        rant comes back or its Future fails, which bounds the work queued
+        for the daemon.  Out of credits, overload="block" waits up to
+        ack_timeout for one and overload="reject" gives up at once, either
+        way with an IOError
+        """
+        with self._rant_lock:
+            if advice.id in self._credited:
+                return
+        if self.overload == "reject":
+            acquired = self._credits.acquire(blocking=False)
         else:
-            return self.get_rant(advice)
-
-    # TODO: This method is broken somehow. The daemon is sending the rant,
-    # but this guy isn't populating self.rants.  Likely some exception is
-    # killing the thread.
-    def rant_listener_func(self):
-        socket = self._get_socket(zmq.REP)
-        socket.connect("{}://{}:{}".format(self.protocol,
-                                           self.ip,
-                                           self.rant_port))
-        while not self.stop:
-            rant = self._str_to_pyobj(socket.recv_unicode())
-            LOG.debug("Recieved rant: {}".format(rant.id))
+            acquired = self._credits.acquire(timeout=self.ack_timeout)
+        if not acquired:
+            raise IOError("Client {} already has {} advice outstanding".format(
+                self.name, self.max_outstanding))
+        with self._rant_lock:
+            self._credited.add(advice.id)
+        self.expect_rant(advice).add_done_callback(
+            lambda future: self._return_credit(advice.id))
+
+    def _return_credit(self, advice_id):
+        with self._rant_lock:
+            if advice_id not in self._credited:
+                return
+            self._credited.discard(advice_id)
+        self._credits.release()
+
+    def send_control(self, advice, block=True):
+        """
+        Send advice the daemon handles itself and only acks (eg. subscribe),
+        no Rant is expected for it
+        """
+        if not self.ready:
+            self.start()
+        self._send(advice, block)
+
+    def cancel(self, advice, block=True):
+        """
+        Ask the daemon to stop advice that is still queued or running.
+        Returns the advice's Future, which is completed with a CANCELLED
+        rant if the daemon got to it in time, or None if no rant is
+        expected for it
+        """
+        with self._rant_lock:
+            future = self._futures.get(advice.id)
+        self.send_control(adviceFactory(advice.id, type="cancel"), block)
+        return future
+
+    def mark_sent(self, advice):
+        """
+        Note when advice went out, for advice sent on our behalf (eg.
+        published to a TherapyGroup) as well as our own
+        """
+        self._sent_at[advice.id] = time()
+
+    def _record_timings(self, rant):
+        """
+        Complete the daemon's timings of a rant with the stages measured
+        here and add them to self.latency
+        """
+        if isinstance(rant, RantChunk):
+            return rant
+        queued = self._queued_at.pop(rant.id, None)
+        sent = self._sent_at.pop(rant.id, None)
+        if sent is None or not rant.timings:
+            return rant
+        now = time()
+        timings = dict(rant.timings)
+        on_daemon = sum(timings.get(stage, 0)
+                        for stage in ("queue_wait", "run", "rant_queue"))
+        queued = min(queued or sent, sent)
+        timings["controller_queue"] = sent - queued
+        timings["network"] = max(0, now - sent - on_daemon)
+        timings["total"] = now - queued
+        self.latency.record(timings)
+        return rant._replace(timings=timings)
+
+    def _send(self, advice, block):
+        with self._advice_lock:
+            socket = self._get_advice_socket()
+            while len(self._in_flight) >= self.max_in_flight:
+                self._recv_ack()
+            LOG.debug("Sending adviceFactory: {}".format(advice))
+            socket.send_multipart([b""] + self.codec.encode(advice),
+                                  copy=False)
+            self._in_flight[advice.id] = advice
+            # Opportunistically retire any acks that are already waiting
+            while self._in_flight and socket.poll(0):
+                self._recv_ack()
+            while block and advice.id in self._in_flight:
+                self._recv_ack()
+
+    def flush_advice(self):
+        """
+        Block until every pipelined advice has been acknowledged
+        """
+        with self._advice_lock:
+            while self._in_flight:
+                self._recv_ack()
+
+    def send_and_receive(self, advice, timeout=None):
+        self.send_advice(advice)
+        return self.get_rant(advice, timeout=timeout)
+
+    def expect_rant(self, advice):
+        """
+        Returns the Future that will be completed by _on_rant
+        when the Rant for this advice arrives
+        """
+        with self._rant_lock:
+            if getattr(advice, "stream", False):
+                self._streams.setdefault(advice.id, queue.Queue())
+            future = self._futures.get(advice.id)
+            if not future:
+                future = self._futures[advice.id] = Future()
+                if advice.id in self.rants:
+                    future.set_result(self.rants[advice.id])
+                else:
+                    self._queued_at.setdefault(advice.id, time())
+                    future.add_done_callback(
+                        lambda future: self._forget_sent(advice.id))
+            return future
+
+    def _forget_sent(self, advice_id):
+        """
+        Drop the timestamps of advice whose Future is done.  A rant has
+        used them already, failed advice (on an ack timeout, out of
+        credits or with its member down) never will
+        """
+        self._queued_at.pop(advice_id, None)
+        self._sent_at.pop(advice_id, None)
+
+    def _on_rant(self, socket):
+        envelope, frames = split_envelope(socket.recv_multipart(copy=False))
+        rant = self._record_timings(self._frames_to_pyobj(
+            frames, self.compression_stats))
+        self.last_seen = time()
+        LOG.debug("Recieved rant: {}".format(rant.id))
+        socket.send_multipart(envelope + [
+            "Recieved rant: {}".format(rant.id).encode("utf-8")])
+        self._deliver_rant(rant)
+
+    def _deliver_rant(self, rant):
+        with self._rant_lock:
+            if isinstance(rant, RantChunk):
+                self._streams.setdefault(rant.id, queue.Queue()).put(rant)
+                return
+            stream = self._streams.pop(rant.id, None)
+            if stream:
+                stream.put(None)
             self.rants[rant.id] = rant
-            socket.send_unicode("Recieved rant: {}".format(rant.id))
+            future = self._futures.pop(rant.id, None)
+        # Completed outside the lock, done callbacks run in the poller
+        # thread so they must not block
+        if future and not future.done():
+            future.set_result(rant)
 
-    def get_rant(self, advice, block=True, poll_interval=None):
-        if block:
-            while not self.stop:
-                try:
-                    return self.rants.pop(advice.id)
-                except KeyError:
-                    LOG.debug("rantFactory id {} not found, sleeping {"
-                              "}".format(advice.id, poll_interval))
-                    if poll_interval:
-                        sleep(poll_interval)
-        else:
-            return self.rants.pop(advice.id, None)
+    def iter_rant(self, advice, timeout=None):
+        """
+        Iterate over the output of a streaming advice chunk by chunk, as
+        bytes, as the daemon produces it.  Ends when the command exits,
+        the final Rant (with the error_code) is then available from
+        get_rant.  Raises TimeoutError if no chunk arrives for timeout
+        seconds
+        """
+        self.expect_rant(advice)
+        with self._rant_lock:
+            stream = self._streams.get(advice.id)
+        if not stream:
+            # Already finished and every chunk has been consumed
+            return
+        while True:
+            try:
+                chunk = stream.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError("No output for advice {} in {} "
+                                   "seconds".format(advice.id, timeout))
+            if chunk is None:
+                return
+            yield chunk.result
 
-    def run_heartbeat(self):
-        socket = self._get_socket(zmq.REQ)
-        while not self.stop:
-            sleep(self.heartbeat_interval)
-            socket.connect("{}://{}:{}".format(self.protocol,
-                                               self.ip,
-                                               self.advice_port))
-            heartbeat = adviceFactory("", "", "heartbeat")
-            socket.send_unicode(simplejson.dumps(heartbeat))
-            resp = socket.recv_unicode()
-            rant = self._str_to_pyobj(resp)
-            if rant.result != "heartbeat_reply":
-                self.heartbeat = False
-            else:
-                self.heartbeat = True
-            # LOG.debug("HEARTBEAT status: {}".format(self.heartbeat))
+    def get_rant(self, advice, block=True, timeout=None):
+        """
+        Pop the Rant for advice.  When blocking, waits on the advice's
+        Future instead of polling, raising TimeoutError after timeout seconds
+        """
+        with self._rant_lock:
+            rant = self.rants.pop(advice.id, None)
+            if rant is not None:
+                self._futures.pop(advice.id, None)
+                return rant
+            if not block:
+                # Still on its way, _deliver_rant completes the Future
+                return None
+        rant = self.expect_rant(advice).result(timeout)
+        with self._rant_lock:
+            self._futures.pop(advice.id, None)
+            self.rants.pop(advice.id, None)
+        return rant
+
+    def _send_heartbeat(self):
+        """
+        Timer callback in the poller thread.  No heartbeat is sent while
+        acks or rants keep proving the daemon is alive
+        """
+        if self.stop:
+            return
+        if self._heartbeat_pending:
+            # Previous heartbeat never came back, a REQ socket can't send
+            # again until it does so start over with a fresh one
+            self.heartbeat = False
+            self._heartbeat_pending = False
+            self.poller.unregister(self._heartbeat_socket)
+            self._heartbeat_socket.close()
+            self._heartbeat_socket = None
+        idle = time() - self.last_seen if self.last_seen else None
+        if idle is not None and idle < self.heartbeat_interval:
+            self.heartbeat = True
+            self.heartbeats_suppressed += 1
+            self._heartbeat_timer = self.poller.call_later(
+                self.heartbeat_interval - idle, self._send_heartbeat)
+            return
+        if not self._heartbeat_socket:
+            socket = self._get_socket(zmq.REQ)
+            socket.setsockopt(zmq.LINGER, 0)
+            socket.connect(endpoint(self.protocol, self.ip, self.advice_port))
+            self.poller.register(socket, self._on_heartbeat)
+            self._heartbeat_socket = socket
+        heartbeat = adviceFactory("", "", "heartbeat")
+        self._heartbeat_socket.send_multipart(self.codec.encode(heartbeat))
+        self._heartbeat_pending = True
+        self.heartbeats_sent += 1
+        self._heartbeat_timer = self.poller.call_later(
+            self.heartbeat_interval, self._send_heartbeat)
+
+    def _on_heartbeat(self, socket):
+        rant = self._frames_to_pyobj(socket.recv_multipart(copy=False))
+        self._heartbeat_pending = False
+        if rant.result != "heartbeat_reply":
+            self.heartbeat = False
+        else:
+            self.heartbeat = True
+            self.last_seen = time()
+        # LOG.debug("HEARTBEAT status: {}".format(self.heartbeat))
 
     @classmethod
     def from_dict(self, d, name=None):
@@ -207,11 +589,45 @@ class Client():
                       "******".format(self.username))
             raise
 
+    def _get_transport(self):
+        """
+        Pooled SSH transport, only (re)connected when there is no live one.
+        Command sessions and the SFTP channel are multiplexed over it
+        """
+        with self._ssh_lock:
+            if not self._transport or not self._transport.is_active():
+                start = time()
+                self._transport = self._setup_transport()
+                self._sftp = None
+                self.ssh_stats["handshakes"] += 1
+                self.ssh_stats["handshake_time"] += time() - start
+            return self._transport
+
+    def _get_sftp(self):
+        with self._ssh_lock:
+            transport = self._get_transport()
+            if not self._sftp or self._sftp.get_channel().closed:
+                self._sftp = paramiko.SFTPClient.from_transport(transport)
+                self.ssh_stats["sftp_channels"] += 1
+            return self._sftp
+
+    def close_ssh(self):
+        """
+        Each transport holds a paramiko thread, so don't keep them around
+        between bootstrap operations
+        """
+        with self._ssh_lock:
+            if self._sftp:
+                self._sftp.close()
+            if self._transport:
+                self._transport.close()
+            self._sftp = self._transport = None
+
     def _exec_command(self, command, error_expected=False):
 
-        tp = self._setup_transport()
+        session = self._get_transport().open_session()
+        self.ssh_stats["sessions"] += 1
         try:
-            session = tp.open_session()
             session.set_combine_stderr(True)
             session.exec_command(command)
             output = ""
@@ -225,26 +641,35 @@ class Client():
                 raise paramiko.SSHException("Non-zero exit status {} from "
                                             "command `{}`".format(status,
                                                                   command))
-            session.close()
             return output
         finally:
-            tp.close()
+            session.close()
 
     def _dir_exists(self, path):
-        transport = self._setup_transport()
-        sftp = paramiko.SFTPClient.from_transport(transport)
         try:
-            sftp.stat(path)
+            self._get_sftp().stat(path)
         except IOError as e:
             if e.errno == errno.ENOENT:
                 return False
             raise
         else:
             return True
-        finally:
-            sftp.close()
 
-    def _setup_venv(self):
+    def _push_wheelhouse(self, wheelhouse):
+        start = time()
+        self._get_sftp().putfo(io.BytesIO(wheelhouse),
+                               REMOTE_WHEELHOUSE_ARCHIVE)
+        self._exec_command("mkdir -p {0} && tar -xzf {1} -C {0} && "
+                           "rm -f {1}".format(REMOTE_WHEELHOUSE,
+                                              REMOTE_WHEELHOUSE_ARCHIVE))
+        self.install_timings["wheelhouse_upload"] = time() - start
+
+    def _setup_venv(self, wheelhouse=None):
+        """
+        :param wheelhouse: tar.gz from therapyst.deploy.build_wheelhouse,
+                           when given requirements are installed from it
+                           with no index access
+        """
         if not self._dir_exists(REMOTE_VENV):
             try:
                 self._exec_command("python3 --version")
@@ -262,41 +687,93 @@ class Client():
             except EnvironmentError:
                 raise EnvironmentError("virtualenv package in required")
 
-            self._exec_command("{} install {}".format(REMOTE_VENV_PIP,
-                                                      REQUIREMENTS))
-            self._exec_command("{} install -e {}".format(REMOTE_VENV_PIP,
-                                                         REMOTE_DIR))
+            pip_install = "{} install".format(REMOTE_VENV_PIP)
+            if wheelhouse:
+                self._push_wheelhouse(wheelhouse)
+                pip_install += " --no-index --find-links {}".format(
+                    REMOTE_WHEELHOUSE)
+            start = time()
+            self._exec_command("{} {}".format(pip_install, REQUIREMENTS))
+            self._exec_command("{} -e {}".format(pip_install, REMOTE_DIR))
+            self.install_timings["pip_install"] = time() - start
 
     def _install_linux(self):
-        transport = self._setup_transport()
-        sftp = paramiko.SFTPClient.from_transport(transport)
+        return self.deploy()
+
+    def _remote_manifest(self):
         try:
-            if not self._dir_exists(REMOTE_DIR):
-                self.put_dir(sftp, LOCAL_FOLDER, "")
-        finally:
-            sftp.close()
+            with self._get_sftp().open(REMOTE_MANIFEST, "rb") as f:
+                return load_manifest(f.read())
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return {}
+            raise
+
+    def deploy(self, manifest=None):
+        """
+        Ship the files of LOCAL_FOLDER whose content differs from the
+        manifest recorded on the Client, as a single compressed archive,
+        and delete files that no longer exist locally.
+
+        :param manifest: precomputed build_manifest(LOCAL_FOLDER)
+        :returns: True if anything changed on the Client
+        """
+        local = manifest if manifest else build_manifest(LOCAL_FOLDER)
+        version = manifest_version(local)
+        changed, removed = diff_manifests(local, self._remote_manifest())
+        if not changed and not removed:
+            LOG.info("Client {} is up to date at {}".format(self.name,
+                                                            version[:12]))
+            self.deployed_version = version
+            return False
+        archive = build_archive(LOCAL_FOLDER, changed)
+        LOG.info("Client {}: shipping {} changed files ({} bytes), removing "
+                 "{}".format(self.name, len(changed), len(archive),
+                             len(removed)))
+        sftp = self._get_sftp()
+        sftp.putfo(io.BytesIO(archive), REMOTE_ARCHIVE)
+        self._exec_command("mkdir -p {0} && tar -xzf {1} -C {0} && "
+                           "rm -f {1}".format(shlex.quote(REMOTE_DIR),
+                                              REMOTE_ARCHIVE))
+        if removed:
+            self._exec_command("rm -f {}".format(" ".join(
+                shlex.quote(os.path.join(REMOTE_DIR, path))
+                for path in removed)))
+        # Written last, an interrupted deploy is retried in full next time
+        sftp.putfo(io.BytesIO(dump_manifest(local)), REMOTE_MANIFEST)
+        self.deployed_version = version
+        return True
+
+    def _daemon_running(self):
+        # The bracket keeps the ssh shell running pgrep from matching itself
+        pattern = "[{}]{}".format(REMOTE_EXECUTE[0], REMOTE_EXECUTE[1:])
+        return bool(self._exec_command(
+            "pgrep -f {} || true".format(shlex.quote(pattern))).strip())
+
+    def _stop_daemon_linux(self):
+        pattern = "[{}]{}".format(REMOTE_EXECUTE[0], REMOTE_EXECUTE[1:])
+        self._exec_command("pkill -f {}".format(shlex.quote(pattern)),
+                           error_expected=True)
 
     def _install_other(self):
         raise NotImplementedError("Unsupported Host")
 
-    @staticmethod
-    def put_dir(sftp, localpath, remotepath):
-        os.chdir(os.path.split(localpath)[0])
-        parent = os.path.split(localpath)[1]
-        for walker in os.walk(parent):
-            if walker[0] in ["build", "dist"]:
-                continue
-            try:
-                sftp.mkdir(os.path.join(remotepath, walker[0]))
-            except IOError as e:
-                print(e)
-            for file in walker[2]:
-                if file.endswith("egg-info"):
-                    continue
-                sftp.put(os.path.join(walker[0], file), os.path.join(
-                    remotepath, walker[0], file))
+    def install_and_start_daemon(self, wheelhouse=None):
+        start = time()
+        before = dict(self.ssh_stats)
+        try:
+            self._install_and_start_daemon(wheelhouse)
+        finally:
+            self.install_timings["total"] = time() - start
+            self.close_ssh()
+            LOG.info("Client {} bootstrapped in {:.2f}s: {} SSH handshakes "
+                     "({:.2f}s), {} sessions, {} SFTP channels".format(
+                         self.name, time() - start,
+                         *(self.ssh_stats[key] - before[key] for key in (
+                             "handshakes", "handshake_time", "sessions",
+                             "sftp_channels"))))
 
-    def install_and_start_daemon(self):
+    def _install_and_start_daemon(self, wheelhouse=None):
         try:
             cmd = "python3 -c 'import os; print(os.uname().sysname)'"
             result = self._exec_command(cmd).lower()
@@ -305,22 +782,31 @@ class Client():
             result = self._exec_command(cmd).lower()
         if OS_LINUX in result:
             self.os = OS_LINUX
-            self._install_linux()
-            self._setup_venv()
+            changed = self._install_linux()
+            self._setup_venv(wheelhouse)
+            if not changed and self._daemon_running():
+                LOG.info("Client {} already runs {}, not restarting".format(
+                    self.name, self.deployed_version[:12]))
+                return
+            if changed:
+                self._stop_daemon_linux()
             self._start_daemon_linux()
         else:
             self.os = 'other'
             self._install_other()
-            self._setup_venv()
+            self._setup_venv(wheelhouse)
             self._start_daemon_other()
 
     def start_daemon(self):
-        if not self.os:
-            pass
-        elif self.os == OS_LINUX:
-            self._start_daemon_linux()
-        else:
-            self._start_daemon_other()
+        try:
+            if not self.os:
+                pass
+            elif self.os == OS_LINUX:
+                self._start_daemon_linux()
+            else:
+                self._start_daemon_other()
+        finally:
+            self.close_ssh()
 
     def _start_daemon_linux(self):
         # TODO: Figure out how to get the PID for the started process
@@ -343,6 +829,9 @@ class Client():
         raise NotImplementedError("Unsupported Host")
 
     def _setup_auth_thread(self):
+        if self.context is shared_context():
+            self.auth_thread = shared_authenticator(CERTS_DIR)
+            return
         self.auth_thread = ThreadAuthenticator(self.context)
         self.auth_thread.start()
         self.auth_thread.allow('172.0.0.1')
@@ -353,22 +842,106 @@ class ClientDaemon():
 
     """
     Daemon process running on the client
+
+    At most pool_size advice run at once, and at most type_limits[type] of
+    any one advice type.  pool_size is max_threads when given, otherwise it
+    follows the host's CPU count and load (see
+    therapyst.executor.adaptive_pool_size), re-evaluated every
+    resize_interval seconds.  executor picks the backend advice runs on,
+    one of therapyst.executor.BACKENDS
+
+    Commands are killed once their advice's timeout expires, and "cancel"
+    advice (whose cmd is the id of another advice) stops that advice if it
+    is still queued or running.  Either way its rant has the TIMEOUT or
+    CANCELLED error_code from therapyst.data
+
+    The last recent_results rants are remembered by advice id, advice
+    delivered again is answered from there (or ignored while it is still
+    running) instead of being run twice.  Shell advice with a cache TTL is
+    answered from the last successful run of the same command within that
+    many seconds, at most cache_size commands are kept.  Each keeps at
+    most recent_bytes and cache_bytes of results, bigger results aren't
+    kept at all.  Hits and misses of both are counted in cache_stats
+
+    "stats" advice is answered with a dict of the daemon's latency
+    histograms, cache, compression and pool statistics
+
+    At most max_queued advice wait to run, more is answered right away
+    with a REJECTED rant rather than queued without bound.  The rant queue
+    is bounded the same way.  Streaming advice waits for room in it, other
+    rants are held in an overflow lane until it drains
+
+    Rants go to the Clients that gave their advice without waiting on any
+    of them.  A Client that isn't ready gets a backlog of its own, one
+    unreachable for RANT_PEER_GRACE seconds has its rants resent from the
+    recent results once it is back
+
+    protocol and host pick the endpoints to bind, see therapyst.transport.
+    An inproc daemon runs in the controller's process on its
+    shared_context() and is stopped with close()
     """
 
     def __init__(self, advice_port=ADVICE_DEFAULT_PORT,
-                 rant_port=RANT_DEFAULT_PORT, log=LOG, max_threads=10,
-                 protocol="tcp"):
+                 rant_port=RANT_DEFAULT_PORT,
+                 broadcast_port=BROADCAST_DEFAULT_PORT, log=LOG,
+                 max_threads=None, protocol="tcp", context=None,
+                 chunk_size=64 * 1024, stream_window=8, executor="thread",
+                 type_limits=None, resize_interval=10, recent_results=1024,
+                 cache_size=256, host="0.0.0.0", max_queued=10000,
+                 recent_bytes=32 * MIB, cache_bytes=32 * MIB):
         self.advice_port = advice_port
         self.rant_port = rant_port
-        self.context = zmq.Context()
+        self.broadcast_port = broadcast_port
+        if not context:
+            # inproc endpoints only reach sockets of the same context
+            context = shared_context() if protocol == "inproc" \
+                else zmq.Context()
+        self.context = context
         self.log = log
         self.protocol = protocol
+        self.host = host
+        self._bound = threading.Event()
         self.max_threads = max_threads
-        self.advice_queue = AdviceQueue()
-        self.rant_queue = RantQueue()
+        self.pool_size = max_threads if max_threads else adaptive_pool_size()
+        self.executor = executor
+        self.type_limits = dict(type_limits) if type_limits else {}
+        self.resize_interval = resize_interval
+        self._backend = None
+        self._work = threading.Condition()
+        self._running = {}
+        self._queued_at = {}
+        self._procs = {}
+        self._bulk_steps = {}
+        self._cancelled = set()
+        self._active = set()
+        self._finished_at = {}
+        self.rejected = 0
+        self.latency = LatencyStats()
+        self._recent = ResultCache(recent_results, recent_bytes)
+        self._cache = ResultCache(cache_size, cache_bytes)
+        self.chunk_size = chunk_size
+        self.stream_window = stream_window
+        self._stream_credits = {}
+        # Rants that found the rant queue full, see _put_rant
+        self._overflow = deque()
+        self.max_queued = max_queued
+        self.advice_queue = PriorityAdviceQueue(maxsize=max_queued)
+        self.rant_queue = PriorityRantQueue(maxsize=max_queued)
         self.listener = None
         self.replyer = None
         self.workers = []
+        self._codecs = {}
+        # Rant socket identities of the Clients to answer, per advice id,
+        # and of the Clients subscribed to each broadcast topic
+        self._peers = {}
+        self._topic_peers = {}
+        # Per Client identity: rants it wasn't ready for, when it was
+        # first found unreachable, and (advice id, codec) of the rants held
+        # for it while it is parked.  See _flush_backlog
+        self._backlog = {}
+        self._unreachable = {}
+        self._parked = {}
+        self.compression_stats = {}
         self.stop = False
         self.auth_thread = None
 
@@ -376,46 +949,133 @@ class ClientDaemon():
         LOG.debug("Starting Listener")
         self.listener = threading.Thread(name="listener", target=self._listen)
         self.listener.start()
+        self._bound.wait(10)
         LOG.debug("Starting Replyer")
         self.replyer = threading.Thread(name="replyer", target=self._reply)
         self.replyer.start()
-        LOG.debug("Starting {} Worker Threads".format(self.max_threads))
-        for thread_num in range(self.max_threads):
-            thread = \
-                threading.Thread(name="worker-{}".format(thread_num),
-                                 target=self._worker_function)
-            thread.start()
-            self.workers.append(thread)
+        LOG.debug("Starting {} executor, pool size {}".format(
+            self.executor, self.pool_size))
+        self._backend = get_backend(self.executor)(
+            self._handle_advice, self.max_threads or MAX_POOL_SIZE,
+            self._procs)
+        thread = threading.Thread(name="dispatcher",
+                                  target=self._worker_function)
+        thread.start()
+        self.workers.append(thread)
         self._setup_auth_thread()
 
     def stop_workers(self):
         LOG.debug("Joining Worker Threads")
         self.stop = True
+        with self._work:
+            self._work.notify_all()
         for thread in self.workers:
             thread.join()
+        if self._backend:
+            self._backend.shutdown()
+
+    def close(self):
+        """
+        Stop every thread and close the sockets
+        """
+        self.stop_workers()
+        for thread in (self.listener, self.replyer):
+            if thread:
+                thread.join()
+        if self.auth_thread and self.context is not shared_context():
+            self.auth_thread.stop()
 
     def _get_socket(self, socket_type):
         return self.context.socket(socket_type)
 
-    def _str_to_pyobj(self, string):
-        json = simplejson.loads(string)
-        return adviceFactory(json["cmd"],
-                             json["error_expected"],
-                             json["type"],
-                             json["id"])
-
     @staticmethod
-    def _handle_shell(advice):
+    def _frames_to_pyobj(frames):
+        codec = codec_for(frames)
+        return codec, codec.decode_advice(frames)
+
+    def _handle_shell(self, advice):
         print("Running: {}".format(advice.cmd))
-        proc = subprocess.Popen(
-            shlex.split(advice.cmd),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT)
-        result = proc.communicate()[0]
-        rant = rantFactory(result, proc.returncode, advice)
-        print("Result: {}".format(result))
+        rant = run_shell(advice, self._procs)
+        print("Result: {}".format(rant.result))
         return rant
 
+    def _handle_shell_stream(self, advice):
+        """
+        Forward output in chunks of at most chunk_size as it is produced.
+        No more than stream_window chunks are queued for the replyer at
+        once, so memory stays flat however much the command prints
+        """
+        print("Streaming: {}".format(advice.cmd))
+        credits = self._stream_credits[advice.id] = \
+            threading.Semaphore(self.stream_window)
+        timer = None
+        started = time()
+        try:
+            proc = self._procs[advice.id] = subprocess.Popen(
+                shlex.split(advice.cmd),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                start_new_session=True)
+            if advice.timeout:
+                timer = threading.Timer(advice.timeout, kill_group, [proc])
+                timer.start()
+            with proc.stdout:
+                for seq in count():
+                    data = os.read(proc.stdout.fileno(), self.chunk_size)
+                    if not data:
+                        break
+                    credits.acquire()
+                    self.rant_queue.put(RantChunk(data, seq, advice,
+                                                  advice.id))
+            proc.wait()
+        finally:
+            if timer:
+                timer.cancel()
+            self._procs.pop(advice.id, None)
+            self._stream_credits.pop(advice.id, None)
+        if advice.timeout and proc.returncode == -signal.SIGKILL and \
+                time() - started >= advice.timeout:
+            return rantFactory(b"", TIMEOUT, advice)
+        return rantFactory(b"", proc.returncode, advice)
+
+    def _handle_bulk(self, bulk):
+        """
+        Run each step in order on this worker, stopping early at the first
+        step that fails without error_expected, unless the bulk advice
+        expects errors
+        """
+        rants = []
+        try:
+            for advice in bulk.advices:
+                if bulk.id in self._cancelled:
+                    break
+                # Steps are never streamed, their output belongs in the
+                # BulkRant
+                if getattr(advice, "stream", False):
+                    advice = advice._replace(stream=False)
+                self._bulk_steps[bulk.id] = advice.id
+                rant = self._handle_advice(advice)
+                rants.append(rant)
+                if rant.error_code and not (advice.error_expected or
+                                            bulk.error_expected):
+                    LOG.debug("Bulk advice {} aborted at step {}".format(
+                        bulk.id, len(rants)))
+                    break
+        finally:
+            self._bulk_steps.pop(bulk.id, None)
+        return bulkRantFactory(rants, bulk)
+
+    def _handle_stats(self, advice):
+        stats = {"latency": self.latency.summary(),
+                 "cache": self.cache_stats,
+                 "compression": dict(self.compression_stats),
+                 "executor": self.executor,
+                 "pool_size": self.pool_size,
+                 "running": sum(self._running.values()),
+                 "queued": len(self._queued_at),
+                 "rejected": self.rejected}
+        return rantFactory(stats, 0, advice)
+
     @staticmethod
     def _handle_heartbeat(advice):
         rant = rantFactory("heartbeat_reply", 0, advice)
@@ -424,38 +1084,404 @@ class ClientDaemon():
 
     def _listen(self):
         # TODO Add zmq.auth authentication to connection
-        socket = self._get_socket(zmq.REP)
-        socket.bind("{}://0.0.0.0:{}".format(self.protocol, self.advice_port))
+        # ROUTER so that both pipelined DEALER peers and plain REQ peers
+        # (heartbeats) can talk to us.  Everything up to the empty delimiter
+        # is the routing envelope and is echoed back untouched.
+        socket = self._get_socket(zmq.ROUTER)
+        socket.setsockopt(zmq.RCVHWM, self.max_queued)
+        # A Client reconnecting under its identity takes over from its old
+        # connection
+        socket.setsockopt(zmq.ROUTER_HANDOVER, 1)
+        socket.bind(bind_endpoint(self.protocol, self.host, self.advice_port))
+        # TherapyGroups publish advice once to all their members, the
+        # Therapyst tells us which group topics to listen to
+        broadcast = self._get_socket(zmq.SUB)
+        broadcast.setsockopt(zmq.RCVHWM, self.max_queued)
+        broadcast.bind(bind_endpoint(self.protocol, self.host,
+                                     self.broadcast_port))
+        self._bound.set()
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
+        poller.register(broadcast, zmq.POLLIN)
+        try:
+            self._serve(socket, broadcast, poller)
+        finally:
+            socket.close(linger=0)
+            broadcast.close(linger=0)
+
+    def _serve(self, socket, broadcast, poller):
         while not self.stop:
-            advice = self._str_to_pyobj(socket.recv_unicode())
+            # Wake up now and then to notice close()
+            events = dict(poller.poll(1000))
+            if broadcast in events:
+                self._on_broadcast(broadcast.recv_multipart(copy=False))
+            if socket not in events:
+                continue
+            envelope, msg = split_envelope(socket.recv_multipart(copy=False))
+            codec, advice = self._frames_to_pyobj(msg)
+            peer = envelope[0].bytes if envelope else None
             if advice.type == "heartbeat":
-                rant = self._handle_heartbeat(advice)
-                socket.send_unicode(simplejson.dumps(rant._asdict()))
+                reply = codec.encode(self._handle_heartbeat(advice))
+            elif advice.type in ("subscribe", "unsubscribe"):
+                option = zmq.SUBSCRIBE if advice.type == "subscribe" \
+                    else zmq.UNSUBSCRIBE
+                broadcast.setsockopt(option, advice.cmd.encode("utf-8"))
+                self._subscribe(advice, peer)
+                LOG.debug("{} {}".format(advice.type, advice.cmd))
+                reply = [advice.id.encode("utf-8")]
+            elif advice.type == "cancel":
+                self._cancel(advice.cmd)
+                reply = [advice.id.encode("utf-8")]
+            elif advice.type == "stats":
+                self._answer_to(advice, codec, peer)
+                self._put_rant(self._handle_stats(advice))
+                reply = [advice.id.encode("utf-8")]
             else:
-                self.advice_queue.put(advice)
-                socket.send_unicode("Recieved advice {}".format(advice.id))
+                self._answer_to(advice, codec, peer)
+                self._enqueue(advice)
+                reply = [advice.id.encode("utf-8")]
+            socket.send_multipart(envelope + reply, copy=False)
+
+    def _on_broadcast(self, frames):
+        """
+        Group advice arrives as [topic, message...] and isn't acked, its
+        rant goes back over the rant channel to the Clients subscribed to
+        the topic
+        """
+        codec, advice = self._frames_to_pyobj(frames[1:])
+        for peer in self._topic_peers.get(frames[0].bytes, ()):
+            self._answer_to(advice, codec, peer)
+        if advice.type == "heartbeat":
+            self._put_rant(self._handle_heartbeat(advice))
+        else:
+            self._enqueue(advice)
+
+    def _answer_to(self, advice, codec, peer):
+        """
+        Note who to send the rant of advice to, and in which codec: the
+        one the advice came in.  A duplicate from another Client adds it
+        to the peers, so both get the rant.  Peers without an identity of
+        their own (zmq makes one up, starting with a zero byte) have no
+        rant socket to answer
+        """
+        self._codecs[advice.id] = codec
+        peers = self._peers.setdefault(advice.id, [])
+        if peer and not peer.startswith(b"\0") and peer not in peers:
+            peers.append(peer)
+
+    def _subscribe(self, advice, peer):
+        peers = self._topic_peers.setdefault(advice.cmd.encode("utf-8"), [])
+        if advice.type == "subscribe":
+            if peer not in peers:
+                peers.append(peer)
+        elif peer in peers:
+            peers.remove(peer)
+            if not peers:
+                del self._topic_peers[advice.cmd.encode("utf-8")]
+
+    def _cancel(self, advice_id):
+        """
+        Cancel advice that is queued or running, returns whether it was
+        found.  Shell advice running in the process executor can't be
+        reached and is left to its timeout
+        """
+        if advice_id in self._queued_at or advice_id in self._bulk_steps:
+            self._cancelled.add(advice_id)
+        proc = self._procs.get(self._bulk_steps.get(advice_id, advice_id))
+        if proc:
+            self._cancelled.add(advice_id)
+            kill_group(proc)
+        LOG.debug("Cancel {}: {}".format(
+            advice_id, advice_id in self._cancelled))
+        return advice_id in self._cancelled
+
+    @property
+    def cache_stats(self):
+        return {"recent": dict(self._recent.stats),
+                "cache": dict(self._cache.stats)}
+
+    @staticmethod
+    def _cacheable(advice):
+        return advice.type == "shell" and not advice.stream and \
+            getattr(advice, "cache", None)
+
+    def _enqueue(self, advice):
+        if advice.id in self._active:
+            LOG.debug("Ignoring duplicate of running {}".format(advice.id))
+            return
+        rant = self._recent.get(advice.id)
+        if rant:
+            LOG.debug("Answering duplicate {} again".format(advice.id))
+            self._put_rant(rant)
+            return
+        if self._cacheable(advice):
+            rant = self._cache.get(advice.cmd)
+            if rant:
+                # Answered from the cache, so it has no timings of its own
+                rant = rant._replace(advice=advice, id=advice.id,
+                                     timings=None)
+                self._recent.put(advice.id, rant)
+                self._put_rant(rant)
+                return
+        if len(self._queued_at) >= self.max_queued:
+            # Never block the listener, heartbeats go through it too
+            self.rejected += 1
+            self._put_rant(rantFactory(
+                "{} advice already queued".format(self.max_queued),
+                REJECTED, advice))
+            return
+        self._active.add(advice.id)
+        self._queued_at[advice.id] = time()
+        self.advice_queue.put(advice)
+        with self._work:
+            self._work.notify()
+
+    def _put_rant(self, rant):
+        """
+        Queue a rant without ever blocking the listener or the executor
+        backends.  When the
+        RantQueue is full the rant waits in an overflow lane instead, sent
+        once the queue has drained, so rants are never lost.  The overflow
+        is bounded by the advice accepted, and by max_outstanding on each
+        controller
+        """
+        if not self._overflow:
+            try:
+                self.rant_queue.put_nowait(rant)
+                return
+            except queue.Full:
+                LOG.warning("Rant queue full, holding rants in overflow")
+        self._overflow.append(rant)
+
+    def _next_rant(self, timeout=1):
+        # Overflow goes after what is queued, which also keeps the final
+        # rant of a stream behind its chunks
+        try:
+            if self._overflow:
+                return self.rant_queue.get_nowait()
+            return self.rant_queue.get(timeout=timeout)
+        except queue.Empty:
+            return self._overflow.popleft() if self._overflow else None
 
     def _reply(self):
-        socket = self._get_socket(zmq.REQ)
-        socket.bind("{}://0.0.0.0:{}".format(self.protocol, self.rant_port))
+        # ROUTER so each rant goes to the Client that gave the advice,
+        # addressed by the identity of its rant socket.  Unknown identities
+        # fail instead of being silently dropped
+        socket = self._get_socket(zmq.ROUTER)
+        socket.setsockopt(zmq.ROUTER_MANDATORY, 1)
+        socket.setsockopt(zmq.ROUTER_HANDOVER, 1)
+        socket.bind(bind_endpoint(self.protocol, self.host, self.rant_port))
+        try:
+            self._reply_loop(socket)
+        finally:
+            socket.close(linger=0)
+
+    def _reply_loop(self, socket):
         while not self.stop:
-            rant = self.rant_queue.get()
+            self._drain_acks(socket)
+            self._flush_backlog(socket)
+            # Come back soon to retry Clients that weren't ready
+            rant = self._next_rant(timeout=0.05 if self._backlog else 1)
+            if rant is None:
+                continue
             LOG.debug("Sending rantFactory: {}".format(rant.id))
-            socket.send_unicode(simplejson.dumps(rant._asdict()))
-            LOG.debug(socket.recv_unicode())
+            if isinstance(rant, RantChunk):
+                codec = self._codecs.get(rant.id, CODECS["json"])
+                peers = self._peers.get(rant.id, ())
+            else:
+                codec = self._codecs.pop(rant.id, CODECS["json"])
+                peers = self._peers.pop(rant.id, ())
+                finished = self._finished_at.pop(rant.id, None)
+                if finished and rant.timings:
+                    rant_queue = time() - finished
+                    self.latency.record({"rant_queue": rant_queue})
+                    rant = rant._replace(timings=dict(rant.timings,
+                                                      rant_queue=rant_queue))
+            if not peers:
+                LOG.warning("No Client to send rant {} to".format(rant.id))
+            # A chunk's stream credit comes back once every peer has it
+            pending = [len(peers)] if isinstance(rant, RantChunk) else None
+            item = (rant, codec, codec.encode(rant, self.compression_stats),
+                    pending)
+            for peer in peers:
+                self._deliver(socket, peer, item)
+            if pending == [0]:
+                self._sent(item)
+
+    def _deliver(self, socket, peer, item):
+        """
+        Send a rant to one Client, or queue it behind the Client's backlog
+        when it isn't ready for it.  Never waits, so a slow or missing
+        Client doesn't hold up the others
+        """
+        if peer not in self._backlog and self._send_to(socket, peer, item[2]):
+            self._sent(item)
+        else:
+            self._backlog.setdefault(peer, deque()).append(item)
+
+    def _send_to(self, socket, peer, frames):
+        try:
+            socket.send_multipart([peer, b""] + frames, zmq.NOBLOCK,
+                                  copy=False)
+        except zmq.Again:
+            # Connected, but its rant socket is full
+            return False
+        except zmq.ZMQError as e:
+            if e.errno != zmq.EHOSTUNREACH:
+                raise
+            self._unreachable.setdefault(peer, time())
+            return False
+        self._unreachable.pop(peer, None)
+        return True
+
+    def _sent(self, item):
+        pending = item[3]
+        if pending is None:
+            return
+        pending[0] -= 1
+        if pending[0] <= 0:
+            credits = self._stream_credits.get(item[0].id)
+            if credits:
+                credits.release()
+
+    def _drain_acks(self, socket):
+        while True:
+            try:
+                frames = socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return
+            LOG.debug(frames[-1].decode("utf-8", "replace"))
+
+    def _flush_backlog(self, socket):
+        """
+        Send what Clients weren't ready for.  A Client unreachable for
+        RANT_PEER_GRACE seconds is parked: its chunks are given up and its
+        rants are kept by advice id, to be resent from the recent results
+        when it is tried again RANT_PEER_GRACE seconds later
+        """
+        now = time()
+        for peer in list(self._parked):
+            if peer in self._backlog or \
+                    now - self._unreachable.get(peer, 0) <= RANT_PEER_GRACE:
+                continue
+            for advice_id, codec in self._parked.pop(peer):
+                rant = self._recent.get(advice_id)
+                if rant is None:
+                    LOG.warning("Rant {} is no longer held, it can't be "
+                                "resent".format(advice_id))
+                    continue
+                self._backlog.setdefault(peer, deque()).append(
+                    (rant, codec, codec.encode(rant, self.compression_stats),
+                     None))
+        for peer in list(self._backlog):
+            backlog = self._backlog[peer]
+            while backlog and self._send_to(socket, peer, backlog[0][2]):
+                self._sent(backlog.popleft())
+            if not backlog:
+                del self._backlog[peer]
+            elif now - self._unreachable.get(peer, now) > RANT_PEER_GRACE:
+                self._park(peer)
+
+    def _park(self, peer):
+        backlog = self._backlog.pop(peer)
+        LOG.warning("Client {} unreachable, holding {} rants for it".format(
+            peer.decode("ascii", "replace"), len(backlog)))
+        parked = self._parked.setdefault(peer, [])
+        for item in backlog:
+            if item[3] is None:
+                parked.append((item[0].id, item[1]))
+            else:
+                self._sent(item)
+        self._unreachable[peer] = time()
 
     def _worker_function(self):
+        """
+        Hand queued advice to the executor backend as soon as the pool and
+        the advice's type both have a free slot.  Advice of a type at its
+        cap waits without holding up other types.  Otherwise advice runs
+        by priority, with the groups giving it taking turns
+        """
+        pending = Lanes()
+        resized = time()
         while not self.stop:
-            advice = self.advice_queue.get()
+            if not self.max_threads and \
+                    time() - resized >= self.resize_interval:
+                self.pool_size = adaptive_pool_size()
+                resized = time()
+            with self._work:
+                while True:
+                    try:
+                        pending.append(self.advice_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                advice = self._next_runnable(pending)
+                if not advice:
+                    # Woken by new advice or finished advice
+                    self._work.wait(1)
+                    continue
+                self._running[advice.type] = \
+                    self._running.get(advice.type, 0) + 1
             self.log.debug("Received object: {}".format(advice))
-            if advice.type == "shell":
-                rant = self._handle_shell(advice)
-            else:
-                rant = rantFactory("unknown advice", 1, advice)
-            self.rant_queue.put(rant)
+            self._submit(advice)
+
+    def _next_runnable(self, pending):
+        if sum(self._running.values()) >= self.pool_size:
+            return None
+
+        def runnable(advice):
+            limit = self.type_limits.get(advice.type)
+            return limit is None or self._running.get(advice.type, 0) < limit
+        return pending.pop(runnable)
+
+    def _submit(self, advice):
+        started = time()
+        queue_wait = started - self._queued_at.pop(advice.id, started)
+
+        def done(rant):
+            if advice.id in self._cancelled:
+                self._cancelled.discard(advice.id)
+                rant = rant._replace(error_code=CANCELLED)
+            timings = {"queue_wait": queue_wait, "run": time() - started}
+            self.log.debug("Advice {} waited {:.3f}s, ran {:.3f}s".format(
+                advice.id, timings["queue_wait"], timings["run"]))
+            rant = rant._replace(timings=timings)
+            self.latency.record(timings)
+            self._finished_at[advice.id] = time()
+            self._recent.put(advice.id, rant)
+            if self._cacheable(advice) and rant.error_code == 0:
+                self._cache.put(advice.cmd, rant, advice.cache)
+            self._active.discard(advice.id)
+            # Called on the backend's event loop or pool thread, which must
+            # never wait for room in the rant queue
+            self._put_rant(rant)
             self.advice_queue.task_done()
+            with self._work:
+                self._running[advice.type] -= 1
+                self._work.notify()
+
+        if advice.id in self._cancelled:
+            done(rantFactory("Cancelled before running", CANCELLED, advice))
+            return
+        self._backend.submit(advice, done)
+
+    def _handle_advice(self, advice):
+        try:
+            if advice.type == "shell" and advice.stream:
+                return self._handle_shell_stream(advice)
+            elif advice.type == "shell":
+                return self._handle_shell(advice)
+            elif advice.type == "bulk":
+                return self._handle_bulk(advice)
+        except OSError as e:
+            # eg. command not found, don't let it take the worker down
+            return rantFactory(str(e), e.errno or 1, advice)
+        return rantFactory("unknown advice", 1, advice)
 
     def _setup_auth_thread(self):
+        if self.context is shared_context():
+            # Running inside the controller's process
+            self.auth_thread = shared_authenticator(CERTS_DIR)
+            return
         self.auth_thread = ThreadAuthenticator(self.context)
         self.auth_thread.start()
         self.auth_thread.allow('172.0.0.1')
@@ -470,10 +1496,31 @@ def main():
     parser.add_argument("-p2", "--port2", action="store",
                         default=RANT_DEFAULT_PORT,
                         help="Port number for rant_stream to bind to")
+    parser.add_argument("-p3", "--port3", action="store",
+                        default=BROADCAST_DEFAULT_PORT,
+                        help="Port number for group broadcasts to bind to")
+    parser.add_argument("--protocol", action="store", default="tcp",
+                        choices=PROTOCOLS[:2],
+                        help="Transport to listen on")
+    parser.add_argument("--host", action="store", default="0.0.0.0",
+                        help="Address to bind, the socket directory for ipc")
+    parser.add_argument("-e", "--executor", action="store", default="thread",
+                        help="Backend advice runs on: thread, asyncio or "
+                             "process")
+    parser.add_argument("-t", "--max-threads", action="store", type=int,
+                        default=None,
+                        help="Fixed number of advice to run at once, sized "
+                             "from CPU count and load when not given")
     args = parser.parse_args()
 
-    daemon = ClientDaemon(advice_port=args.port1, rant_port=args.port2)
+    daemon = ClientDaemon(advice_port=args.port1, rant_port=args.port2,
+                          broadcast_port=args.port3, executor=args.executor,
+                          max_threads=args.max_threads,
+                          protocol=args.protocol, host=args.host)
     daemon.start()
+    # The executor's pools refuse work once the interpreter starts shutting
+    # down, which it does as soon as the main thread returns
+    daemon.listener.join()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+"""
+Wire codecs for Advice and Rants.
+
+Every message is a list of zmq frames.  The codec of an incoming message
+is recognized from its first byte, so the ClientDaemon simply answers in
+whichever codec the Therapyst spoke to it:
+
+    json    single frame of JSON, the original format
+    framed  b"F" + a small JSON envelope, followed by one raw frame per
+            result payload.  Payloads are never escaped or embedded, and
+            are sent with copy=False
+
+Either codec compresses results as asked by the advice's compress spec,
+see therapyst.compression
+"""
+
+import base64
+
+import zmq
+import simplejson
+
+from therapyst.compression import compress, decompress, record
+from therapyst.data import adviceFromDict, rantFromDict
+
+FRAMED_TAG = b"F"
+
+
+def _to_bytes(frame):
+    if isinstance(frame, zmq.Frame):
+        return frame.bytes
+    return bytes(frame)
+
+
+def _first_byte(frame):
+    if isinstance(frame, zmq.Frame):
+        return bytes(frame.buffer[:1])
+    return bytes(frame[:1])
+
+
+def _spec(obj):
+    # Rants are compressed according to the advice they answer
+    return getattr(getattr(obj, "advice", None), "compress", None)
+
+
+def _payload(result):
+    """
+    Returns (bytes, was_str) for a result payload, None for anything else
+    """
+    if isinstance(result, str):
+        return result.encode("utf-8"), True
+    if isinstance(result, (bytes, bytearray, memoryview)):
+        return result, False
+    return None
+
+
+def _unpayload(data, was_str):
+    return data.decode("utf-8") if was_str else data
+
+
+class JsonCodec():
+
+    """
+    Compressed results and stream chunks are base64 encoded inside the
+    JSON.  Complete results are sent and arrive as text, as they always
+    have over json, but chunks stay bytes: a chunk can end inside a
+    multibyte character that only the next chunk completes
+    """
+
+    name = "json"
+
+    def _text(self, obj, spec, stats):
+        d = obj._asdict()
+        payload = _payload(d.get("result"))
+        if payload:
+            data, was_str = payload
+            algo, wire = compress(data, spec)
+            record(stats, len(data), len(wire))
+            if algo or (not was_str and "seq" in d):
+                d["result"] = {"str": was_str,
+                               "data": base64.b64encode(wire).decode("ascii")}
+                if algo:
+                    d["result"]["z"] = algo
+            elif not was_str:
+                d["result"] = bytes(data).decode("utf-8", "replace")
+        if "rants" in d:
+            d["rants"] = [self._text(rant, spec, stats) for rant in d["rants"]]
+        return d
+
+    def _restore(self, d, stats):
+        result = d.get("result")
+        if isinstance(result, dict) and "data" in result:
+            data = wire = base64.b64decode(result["data"])
+            if "z" in result:
+                data = decompress(result["z"], wire)
+            record(stats, len(data), len(wire))
+            if "seq" not in d or result["str"]:
+                # Results over json have always been text
+                data = data.decode("utf-8", "replace")
+            d["result"] = data
+        elif isinstance(result, str):
+            record(stats, len(result), len(result))
+        for rant in d.get("rants", ()):
+            self._restore(rant, stats)
+        return d
+
+    def encode(self, obj, stats=None):
+        return [simplejson.dumps(
+            self._text(obj, _spec(obj), stats)).encode("utf-8")]
+
+    def decode_advice(self, frames):
+        return adviceFromDict(simplejson.loads(_to_bytes(frames[0])))
+
+    def decode_rant(self, frames, stats=None):
+        return rantFromDict(self._restore(
+            simplejson.loads(_to_bytes(frames[0])), stats))
+
+
+class FramedCodec():
+
+    """
+    Result payloads travel as their own frames, the envelope only holds
+    the frame index, whether the payload was str or bytes and how it was
+    compressed.  Results of shell advice therefore arrive as the bytes the
+    daemon produced
+    """
+
+    name = "framed"
+
+    def _strip(self, obj, frames, spec, stats):
+        d = obj._asdict()
+        payload = _payload(d.get("result"))
+        if payload:
+            data, was_str = payload
+            algo, wire = compress(data, spec)
+            record(stats, len(data), len(wire))
+            frames.append(wire)
+            d["result"] = {"frame": len(frames) - 1, "str": was_str}
+            if algo:
+                d["result"]["z"] = algo
+        if "rants" in d:
+            d["rants"] = [self._strip(rant, frames, spec, stats)
+                          for rant in d["rants"]]
+        return d
+
+    def _restore(self, d, frames, stats):
+        result = d.get("result")
+        if isinstance(result, dict) and "frame" in result:
+            data = wire = _to_bytes(frames[result["frame"]])
+            if "z" in result:
+                data = decompress(result["z"], wire)
+            record(stats, len(data), len(wire))
+            d["result"] = _unpayload(data, result["str"])
+        for rant in d.get("rants", ()):
+            self._restore(rant, frames, stats)
+        return d
+
+    def encode(self, obj, stats=None):
+        frames = [None]
+        envelope = self._strip(obj, frames, _spec(obj), stats)
+        frames[0] = FRAMED_TAG + simplejson.dumps(
+            envelope, separators=(",", ":")).encode("utf-8")
+        return frames
+
+    def _envelope(self, frames):
+        return simplejson.loads(_to_bytes(frames[0])[len(FRAMED_TAG):])
+
+    def decode_advice(self, frames):
+        return adviceFromDict(self._envelope(frames))
+
+    def decode_rant(self, frames, stats=None):
+        return rantFromDict(self._restore(self._envelope(frames), frames,
+                                          stats))
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec(), FramedCodec())}
+
+
+def get_codec(name):
+    try:
+        return CODECS[name]
+    except KeyError:
+        raise ValueError("Unknown codec {}, choose from {}".format(
+            name, ", ".join(sorted(CODECS))))
+
+
+def codec_for(frames):
+    """
+    Recognize the codec an incoming message was encoded with
+    """
+    if _first_byte(frames[0]) == FRAMED_TAG:
+        return CODECS["framed"]
+    return CODECS["json"]
+
+
+def decode_advice(frames):
+    return codec_for(frames).decode_advice(frames)
+
+
+def decode_rant(frames, stats=None):
+    return codec_for(frames).decode_rant(frames, stats)
+
+
+def split_envelope(frames):
+    """
+    Split a ROUTER message into its routing envelope (up to and including
+    the empty delimiter) and the message body
+    """
+    for i, frame in enumerate(frames):
+        if not len(frame):
+            return frames[:i + 1], frames[i + 1:]
+    return frames[:-1], frames[-1:]
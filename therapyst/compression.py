@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+"""
+Optional compression of Rant results.
+
+A Client (or a single Advice) carries a compression spec, the ClientDaemon
+compresses results at least `threshold` bytes long with it, and the codec
+marks which algorithm was used so the Therapyst can undo it.  Algorithms
+the daemon doesn't know, or results that don't shrink, are sent as is.
+"""
+
+import lzma
+import zlib
+
+DEFAULT_THRESHOLD = 64 * 1024
+
+ALGORITHMS = {
+    "zlib": (lambda data, level: zlib.compress(
+                 data, zlib.Z_DEFAULT_COMPRESSION if level is None else level),
+             zlib.decompress),
+    "lzma": (lambda data, level: lzma.compress(
+                 data, preset=lzma.PRESET_DEFAULT if level is None else level),
+             lzma.decompress),
+}
+
+
+def compressionSpec(algo="zlib", level=None, threshold=DEFAULT_THRESHOLD):
+    """
+    :param algo: one of ALGORITHMS
+    :param level: algorithm specific level (zlib 0-9, lzma preset 0-9)
+    :param threshold: results smaller than this many bytes aren't compressed
+    """
+    if algo not in ALGORITHMS:
+        raise ValueError("Unknown compression {}, choose from {}".format(
+            algo, ", ".join(sorted(ALGORITHMS))))
+    return {"algo": algo, "level": level, "threshold": threshold}
+
+
+def compress(data, spec):
+    """
+    Returns (algo, data), algo is None when data was left uncompressed
+    """
+    if not spec or len(data) < spec.get("threshold", DEFAULT_THRESHOLD):
+        return None, data
+    algo = spec.get("algo")
+    if algo not in ALGORITHMS:
+        return None, data
+    compressed = ALGORITHMS[algo][0](data, spec.get("level"))
+    if len(compressed) >= len(data):
+        return None, data
+    return algo, compressed
+
+
+def decompress(algo, data):
+    return ALGORITHMS[algo][1](data)
+
+
+def record(stats, raw_bytes, wire_bytes):
+    if stats is None:
+        return
+    stats["results"] = stats.get("results", 0) + 1
+    stats["raw_bytes"] = stats.get("raw_bytes", 0) + raw_bytes
+    stats["wire_bytes"] = stats.get("wire_bytes", 0) + wire_bytes
+    stats["saved_bytes"] = stats["raw_bytes"] - stats["wire_bytes"]
@@ -1,32 +1,120 @@
 #!/usr/bin/env python
 
-from collections import namedtuple
+from collections import namedtuple, OrderedDict, deque
 from queue import Queue
 from uuid import uuid4
 
-Advice = namedtuple("Advice", "cmd error_expected type id")
-Rant = namedtuple("Rant", "result error_code advice id")
+Advice = namedtuple("Advice",
+                    "cmd error_expected type id stream compress timeout "
+                    "cache priority group")
+# timings are how long the advice spent in each stage, in seconds, see
+# therapyst.stats
+Rant = namedtuple("Rant", "result error_code advice id timings")
+# Partial output of a streaming Advice, the final Rant follows the last one
+RantChunk = namedtuple("RantChunk", "result seq advice id")
+# What a TherapyGroup heard about one advice, indexed by member name.
+# stragglers haven't ranted yet, errors maps members that failed to the
+# exception
+GroupRant = namedtuple("GroupRant", "rants stragglers errors")
+# Outcome of bootstrapping a TherapyGroup, indexed by member name
+InstallSummary = namedtuple("InstallSummary", "succeeded failed durations")
+BulkAdvice = namedtuple("BulkAdvice",
+                        "advices error_expected type id compress priority "
+                        "group")
+BulkRant = namedtuple("BulkRant", "rants error_code advice id timings")
+
+# Advice.priority, queued advice with the lowest value goes first
+HIGH_PRIORITY = 0
+NORMAL_PRIORITY = 10
+LOW_PRIORITY = 20
+# Advice the daemon answers itself jumps ahead of everything else
+CONTROL_PRIORITY = -1
+CONTROL_TYPES = ("heartbeat", "cancel", "stats", "subscribe", "unsubscribe")
 
 
 # Dynamically generate UUID for each Advice Instance
 # Rants get their id from their paired Adivce instance
-def adviceFactory(cmd="", error_expected=False, type="shell", id=None):
+# compress is a therapyst.compression.compressionSpec for the result
+# timeout is how many seconds the daemon lets the command run before
+# killing it
+# cache is how many seconds the daemon may answer the same read only
+# command from an earlier successful run
+# priority orders advice waiting in queues, lowest first.  group is the
+# TherapyGroup that gave it, groups take turns within a priority
+def adviceFactory(cmd="", error_expected=False, type="shell", id=None,
+                  stream=False, compress=None, timeout=None, cache=None,
+                  priority=None, group=None):
+    if priority is None:
+        priority = CONTROL_PRIORITY if type in CONTROL_TYPES else \
+            NORMAL_PRIORITY
     if id:
-        advice = Advice(cmd, error_expected, type, id)
+        advice = Advice(cmd, error_expected, type, id, stream, compress,
+                        timeout, cache, priority, group)
     else:
-        advice = Advice(cmd, error_expected, type, str(uuid4()))
+        advice = Advice(cmd, error_expected, type, str(uuid4()), stream,
+                        compress, timeout, cache, priority, group)
     return advice
 
 
-def rantFactory(result="", error_code="", advice=""):
-    rant = Rant(result, error_code, advice, advice.id)
+# error_code of rants for advice the daemon killed, rather than exited
+TIMEOUT = "timeout"
+CANCELLED = "cancelled"
+# error_code of rants for advice the daemon had no room to queue
+REJECTED = "rejected"
+
+
+def rantFactory(result="", error_code="", advice="", timings=None):
+    rant = Rant(result, error_code, advice, advice.id, timings)
     return rant
 
 
+# Advice executed in order by a single daemon worker, stopping at the
+# first step that fails without error_expected.  error_expected on the
+# BulkAdvice expects failures of every step, so all of them run
+def bulkAdviceFactory(advices, error_expected=False, id=None,
+                      compress=None, priority=NORMAL_PRIORITY, group=None):
+    return BulkAdvice(list(advices), error_expected, "bulk",
+                      id if id else str(uuid4()), compress, priority, group)
+
+
+# error_code is that of the step which aborted the batch, 0 otherwise
+def bulkRantFactory(rants, advice, timings=None):
+    error_code = 0
+    for step, rant in zip(advice.advices, rants):
+        if rant.error_code and not (step.error_expected or
+                                    advice.error_expected):
+            error_code = rant.error_code
+            break
+    return BulkRant(list(rants), error_code, advice, advice.id, timings)
+
+
+def adviceFromDict(d):
+    if d["type"] == "bulk":
+        return bulkAdviceFactory([adviceFromDict(a) for a in d["advices"]],
+                                 d["error_expected"], d["id"],
+                                 d.get("compress"),
+                                 d.get("priority", NORMAL_PRIORITY),
+                                 d.get("group"))
+    return adviceFactory(d["cmd"], d["error_expected"], d["type"], d["id"],
+                         d.get("stream", False), d.get("compress"),
+                         d.get("timeout"), d.get("cache"), d.get("priority"),
+                         d.get("group"))
+
+
+def rantFromDict(d):
+    advice = adviceFromDict(d["advice"])
+    if "rants" in d:
+        return BulkRant([rantFromDict(r) for r in d["rants"]],
+                        d["error_code"], advice, advice.id, d.get("timings"))
+    if "seq" in d:
+        return RantChunk(d["result"], d["seq"], advice, advice.id)
+    return rantFactory(d["result"], d["error_code"], advice, d.get("timings"))
+
+
 class AdviceQueue(Queue):
 
     def put(self, item, **kwargs):
-        if not isinstance(item, Advice):
+        if not isinstance(item, (Advice, BulkAdvice)):
             raise ValueError("AdviceQueue will only accept Advice objects")
         super().put(item, **kwargs)
 
@@ -34,19 +122,90 @@ class AdviceQueue(Queue):
 class RantQueue(Queue):
 
     def put(self, item, **kwargs):
-        if not isinstance(item, Rant):
-            raise ValueError("AdviceQueue will only accept Advice objects")
+        if not isinstance(item, (Rant, BulkRant, RantChunk)):
+            raise ValueError("RantQueue will only accept Rant objects")
         super().put(item, **kwargs)
 
-# Low Priority
-# class BulkAdvice(dict):
 
-#     def __init__(self):
-#         pass
+def advice_lane(advice):
+    return advice.priority, advice.group
+
+
+def rant_lane(rant):
+    return advice_lane(rant.advice)
+
+
+class Lanes():
+
+    """
+    Items in lanes of (priority, group).  pop takes from the lowest
+    priority first and, within a priority, from each group in turn, so a
+    group with a long backlog doesn't hold up the others.  Items of the
+    same lane come out in the order they went in.  Not thread safe
+    """
+
+    def __init__(self, lane=advice_lane):
+        self._lane = lane
+        # {priority: OrderedDict({group: deque}) in turn order}
+        self._lanes = {}
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def append(self, item):
+        priority, group = self._lane(item)
+        groups = self._lanes.setdefault(priority, OrderedDict())
+        groups.setdefault(group, deque()).append(item)
+        self._len += 1
+
+    def pop(self, runnable=None):
+        """
+        Remove and return the next item, or with runnable the next item
+        it accepts.  Returns None when there is no such item
+        """
+        for priority in sorted(self._lanes):
+            groups = self._lanes[priority]
+            for group, items in groups.items():
+                for i, item in enumerate(items):
+                    if runnable is None or runnable(item):
+                        del items[i]
+                        self._len -= 1
+                        if items:
+                            groups.move_to_end(group)
+                        else:
+                            del groups[group]
+                        if not groups:
+                            del self._lanes[priority]
+                        return item
+        return None
+
+
+class _LanesQueue():
+
+    """
+    Queue storage in Lanes, mixed into AdviceQueue and RantQueue
+    """
+
+    lane = None
+
+    def _init(self, maxsize):
+        self.queue = Lanes(self.lane)
+
+    def _qsize(self):
+        return len(self.queue)
+
+    def _put(self, item):
+        self.queue.append(item)
+
+    def _get(self):
+        return self.queue.pop()
+
 
+class PriorityAdviceQueue(_LanesQueue, AdviceQueue):
+    lane = staticmethod(advice_lane)
 
-# Low Priority
-# class BulkRant(dict):
 
-#     def __init__(self):
-#         pass
+class PriorityRantQueue(_LanesQueue, RantQueue):
+    # Chunks of a stream share their advice's lane so stay in order
+    lane = staticmethod(rant_lane)
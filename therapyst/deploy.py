@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+"""
+Content addressed deploys of the therapyst tree to Clients.
+
+The local tree is hashed into a manifest of {relative path: sha256}.  The
+manifest last deployed is kept on each Client, so only files whose hash
+changed are shipped, as one compressed tar archive, and nothing is
+shipped (or restarted) when the versions match.
+
+Requirements can likewise be built into a wheelhouse once on the
+controller and installed on each Client without any index access.
+"""
+
+import io
+import os
+import sys
+import shutil
+import tarfile
+import hashlib
+import tempfile
+import subprocess
+
+import simplejson
+
+SKIP_DIRS = {".git", "build", "dist", "__pycache__", ".pytest_cache", ".tox",
+             ".venv", "venv"}
+SKIP_SUFFIXES = (".pyc", ".pyo", ".egg-info")
+
+
+def _hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_manifest(local_folder):
+    manifest = {}
+    for root, dirs, files in os.walk(local_folder):
+        dirs[:] = [d for d in dirs
+                   if d not in SKIP_DIRS and not d.endswith(SKIP_SUFFIXES)]
+        for name in files:
+            if name.endswith(SKIP_SUFFIXES):
+                continue
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, local_folder).replace(os.sep, "/")
+            manifest[rel] = _hash_file(path)
+    return manifest
+
+
+def manifest_version(manifest):
+    digest = hashlib.sha256()
+    for path in sorted(manifest):
+        digest.update("{} {}\n".format(path, manifest[path]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def diff_manifests(local, remote):
+    """
+    Returns (changed, removed) paths, changed includes new files
+    """
+    changed = sorted(path for path, digest in local.items()
+                     if remote.get(path) != digest)
+    removed = sorted(path for path in remote if path not in local)
+    return changed, removed
+
+
+def build_archive(local_folder, paths):
+    """
+    tar.gz of paths (relative to local_folder) as bytes
+    """
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+        for path in paths:
+            tar.add(os.path.join(local_folder, path), arcname=path)
+    return buf.getvalue()
+
+
+def build_wheelhouse(requirements, pip_args=()):
+    """
+    Build wheels for requirements, plus the setuptools and wheel needed to
+    install the therapyst tree itself, and return them as a tar.gz
+
+    Wheels are built for the controller's platform; when Clients differ
+    pass eg. pip_args=("--platform", "manylinux2014_x86_64",
+    "--python-version", "3.6", "--only-binary=:all:")
+    """
+    folder = tempfile.mkdtemp(prefix="therapyst_wheelhouse")
+    try:
+        subprocess.check_call(
+            [sys.executable, "-m", "pip", "wheel", "--wheel-dir", folder] +
+            list(pip_args) + requirements.split() + ["setuptools", "wheel"])
+        return build_archive(folder, sorted(os.listdir(folder)))
+    finally:
+        shutil.rmtree(folder)
+
+
+def dump_manifest(manifest):
+    return simplejson.dumps({"version": manifest_version(manifest),
+                             "files": manifest}).encode("utf-8")
+
+
+def load_manifest(data):
+    return simplejson.loads(data)["files"]
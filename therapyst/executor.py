@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+"""
+Backends the ClientDaemon runs advice on.
+
+The daemon decides when advice may run (pool size and per type caps), a
+backend only decides where:
+
+    thread   a thread per running advice, the original behavior
+    asyncio  plain shell advice runs as asyncio subprocesses on a single
+             event loop thread, so waiting commands cost no threads
+    process  plain shell advice runs in a pool of worker processes, away
+             from the daemon's GIL
+
+Streaming and bulk advice need the daemon's queues, every backend runs
+those on threads.
+
+Shell commands run in their own process group, so a command that hangs
+past its advice's timeout is killed together with its children.
+"""
+
+import os
+import shlex
+import signal
+import subprocess
+import asyncio
+import logging
+import threading
+import multiprocessing
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from therapyst.data import rantFactory, TIMEOUT
+
+LOG = logging.getLogger(__name__)
+
+MAX_POOL_SIZE = 64
+CHUNK_SIZE = 64 * 1024
+
+
+def adaptive_pool_size(per_cpu=4, minimum=2, maximum=MAX_POOL_SIZE):
+    """
+    Advice mostly waits on its command, so allow per_cpu running advice
+    per CPU, scaled down as the 1 minute load average approaches the
+    number of CPUs
+    """
+    cpus = os.cpu_count() or 1
+    try:
+        load = os.getloadavg()[0]
+    except (AttributeError, OSError):
+        load = 0
+    idle = max(0.25, 1 - load / cpus)
+    return max(minimum, min(maximum, int(cpus * per_cpu * idle)))
+
+
+def kill_group(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run_shell(advice, running=None):
+    """
+    Run a shell advice, killing it when advice.timeout expires.  While it
+    runs the process is kept in running[advice.id] so it can be cancelled
+    """
+    proc = subprocess.Popen(
+        shlex.split(advice.cmd),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        start_new_session=True)
+    if running is not None:
+        running[advice.id] = proc
+    try:
+        try:
+            result = proc.communicate(timeout=advice.timeout)[0]
+        except subprocess.TimeoutExpired:
+            kill_group(proc)
+            return rantFactory(proc.communicate()[0], TIMEOUT, advice)
+    finally:
+        if running is not None:
+            running.pop(advice.id, None)
+    return rantFactory(result, proc.returncode, advice)
+
+
+def _is_plain_shell(advice):
+    return advice.type == "shell" and not advice.stream
+
+
+def _done(callback, advice):
+    def done(future):
+        try:
+            rant = future.result()
+        except OSError as e:
+            # eg. command not found
+            rant = rantFactory(str(e), e.errno or 1, advice)
+        except Exception as e:
+            LOG.exception("Error handling advice {}".format(advice.id))
+            rant = rantFactory(str(e), 1, advice)
+        callback(rant)
+    return done
+
+
+class ThreadBackend():
+
+    name = "thread"
+
+    def __init__(self, handler, max_workers, running=None):
+        """
+        :param handler: handler(advice) returns the rant, run on a thread
+        :param max_workers: upper bound of advice running at once
+        :param running: dict the backend keeps the process of each running
+                        shell advice in, by advice id, when it can
+        """
+        self.handler = handler
+        self.running = running
+        self._threads = ThreadPoolExecutor(max_workers,
+                                           thread_name_prefix="worker")
+
+    def submit(self, advice, callback):
+        """
+        Run advice, callback(rant) is called from the backend when done
+        """
+        future = self._threads.submit(self.handler, advice)
+        future.add_done_callback(_done(callback, advice))
+
+    def shutdown(self):
+        self._threads.shutdown(wait=True)
+
+
+class AsyncioBackend(ThreadBackend):
+
+    name = "asyncio"
+
+    def __init__(self, handler, max_workers, running=None):
+        super().__init__(handler, max_workers, running)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(name="worker-asyncio",
+                                        target=self._loop.run_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    async def _shell(self, advice):
+        proc = await asyncio.create_subprocess_exec(
+            *shlex.split(advice.cmd),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True)
+        if self.running is not None:
+            self.running[advice.id] = proc
+        # Read as it comes so a command killed at its timeout still rants
+        # the output it produced, like run_shell
+        output = bytearray()
+
+        async def run():
+            while True:
+                data = await proc.stdout.read(CHUNK_SIZE)
+                if not data:
+                    break
+                output.extend(data)
+            await proc.wait()
+        try:
+            await asyncio.wait_for(run(), advice.timeout)
+        except asyncio.TimeoutError:
+            kill_group(proc)
+            output.extend(await proc.stdout.read())
+            await proc.wait()
+            return rantFactory(bytes(output), TIMEOUT, advice)
+        finally:
+            if self.running is not None:
+                self.running.pop(advice.id, None)
+        return rantFactory(bytes(output), proc.returncode, advice)
+
+    def submit(self, advice, callback):
+        if not _is_plain_shell(advice):
+            return super().submit(advice, callback)
+        future = asyncio.run_coroutine_threadsafe(self._shell(advice),
+                                                  self._loop)
+        future.add_done_callback(_done(callback, advice))
+
+    def shutdown(self):
+        super().shutdown()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+class ProcessBackend(ThreadBackend):
+
+    """
+    The processes of shell advice run in the pool aren't visible here, so
+    they are only stopped by their timeout, not cancelled
+    """
+
+    name = "process"
+
+    def __init__(self, handler, max_workers, running=None):
+        super().__init__(handler, max_workers, running)
+        # Never fork the daemon, its zmq context and threads don't survive
+        self._processes = ProcessPoolExecutor(
+            max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def submit(self, advice, callback):
+        if not _is_plain_shell(advice):
+            return super().submit(advice, callback)
+        future = self._processes.submit(run_shell, advice)
+        future.add_done_callback(_done(callback, advice))
+
+    def shutdown(self):
+        super().shutdown()
+        self._processes.shutdown(wait=True)
+
+
+BACKENDS = {backend.name: backend
+            for backend in (ThreadBackend, AsyncioBackend, ProcessBackend)}
+
+
+def get_backend(name):
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError("Unknown executor {}, choose from {}".format(
+            name, ", ".join(sorted(BACKENDS))))
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+import os
+import heapq
+import logging
+import threading
+
+from itertools import count
+from time import time
+
+import zmq
+from zmq.auth.thread import ThreadAuthenticator
+
+LOG = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_authenticator = None
+_poller = None
+
+
+def shared_context():
+    """
+    The one zmq.Context used by every Client in this process
+    """
+    return zmq.Context.instance()
+
+
+def shared_authenticator(location):
+    """
+    The one ZAP authenticator for shared_context().  A context can only
+    have a single ZAP handler, so every Client in the process uses this
+    """
+    global _authenticator
+    with _lock:
+        if not _authenticator:
+            _authenticator = ThreadAuthenticator(shared_context())
+            _authenticator.start()
+            _authenticator.allow('172.0.0.1')
+            _authenticator.configure_curve(domain="*", location=location)
+        return _authenticator
+
+
+def shared_poller():
+    """
+    The one Poller thread servicing every Client socket in this process
+    """
+    global _poller
+    with _lock:
+        if not _poller or not _poller.is_alive():
+            _poller = Poller()
+            _poller.start()
+        return _poller
+
+
+class Timer():
+
+    def __init__(self, when, callback):
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Poller(threading.Thread):
+
+    """
+    Single I/O thread multiplexing sockets from many Clients through one
+    zmq.Poller, plus a heap of timers.
+
+    Sockets registered here are owned by this thread, so they should be
+    created, used and closed from callbacks scheduled with call_soon /
+    call_later (which are thread-safe) and from socket callbacks.
+    """
+
+    def __init__(self, max_wait=1.0):
+        super().__init__(name="therapyst_poller")
+        self.daemon = True
+        self.stop = False
+        self.max_wait = max_wait
+        self._poller = zmq.Poller()
+        self._callbacks = {}
+        self._timers = []
+        self._counter = count()
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._poller.register(self._wake_r, zmq.POLLIN)
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b"x")
+        except BlockingIOError:
+            # Pipe is full, the thread is already going to wake up
+            pass
+
+    def call_soon(self, callback, *args):
+        """
+        Run callback(*args) in the poller thread
+        """
+        with self._pending_lock:
+            self._pending.append((callback, args))
+        if threading.current_thread() is not self:
+            self._wake()
+
+    def call_later(self, delay, callback, *args):
+        """
+        Run callback(*args) in the poller thread after delay seconds.
+        Returns a Timer which can be cancelled
+        """
+        timer = Timer(time() + delay, lambda: callback(*args))
+        self.call_soon(self._push_timer, timer)
+        return timer
+
+    def _push_timer(self, timer):
+        heapq.heappush(self._timers, (timer.when, next(self._counter), timer))
+
+    def register(self, socket, callback):
+        """
+        Call callback(socket) whenever socket is readable.  Must be
+        called from the poller thread
+        """
+        self._callbacks[socket] = callback
+        self._poller.register(socket, zmq.POLLIN)
+
+    def unregister(self, socket):
+        self._callbacks.pop(socket, None)
+        self._poller.unregister(socket)
+
+    def _run_pending(self):
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        for callback, args in pending:
+            self._safe_call(callback, *args)
+
+    def _run_timers(self):
+        now = time()
+        while self._timers and self._timers[0][0] <= now:
+            timer = heapq.heappop(self._timers)[2]
+            if not timer.cancelled:
+                self._safe_call(timer.callback)
+
+    def _next_wait(self):
+        if self._pending:
+            return 0
+        if self._timers:
+            return max(0, min(self.max_wait, self._timers[0][0] - time()))
+        return self.max_wait
+
+    @staticmethod
+    def _safe_call(callback, *args):
+        try:
+            callback(*args)
+        except Exception:
+            LOG.exception("Error in poller callback {}".format(callback))
+
+    def run(self):
+        while not self.stop:
+            self._run_pending()
+            self._run_timers()
+            events = dict(self._poller.poll(self._next_wait() * 1000))
+            if events.pop(self._wake_r, None):
+                try:
+                    while os.read(self._wake_r, 4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            for socket in events:
+                callback = self._callbacks.get(socket)
+                if callback:
+                    self._safe_call(callback, socket)
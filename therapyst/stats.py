@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""
+Latency histograms of the stages advice goes through.
+
+Rant.timings holds, in seconds:
+
+    controller_queue  waiting in the Therapyst before being sent
+    queue_wait        waiting in the daemon's AdviceQueue
+    run               executing on the daemon
+    rant_queue        waiting in the daemon's RantQueue to be sent back
+    network           the rest of the round trip, both directions
+    total             from being given to the Therapyst until delivered
+
+The daemon stages are durations measured on the daemon and the rest are
+measured on the controller, so clock differences between hosts don't
+matter.
+"""
+
+import math
+import threading
+
+# Bucket i holds durations in [MIN * GROWTH ** i, MIN * GROWTH ** (i + 1)),
+# so percentiles are accurate to within ~5%
+MIN = 1e-6
+GROWTH = 1.1
+PERCENTILES = (50, 95, 99)
+
+
+class Histogram():
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        bucket = int(math.log(max(value, MIN) / MIN, GROWTH))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q):
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(MIN * GROWTH ** (bucket + 0.5), self.max)
+        return self.max
+
+    def summary(self):
+        summary = {"count": self.count,
+                   "mean": self.total / self.count if self.count else None,
+                   "max": self.max}
+        for q in PERCENTILES:
+            summary["p{}".format(q)] = self.percentile(q)
+        return summary
+
+
+class LatencyStats():
+
+    """
+    A Histogram per stage, fed with Rant.timings
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, timings):
+        if not timings:
+            return
+        with self._lock:
+            for stage, value in timings.items():
+                if isinstance(value, (int, float)):
+                    self.stages.setdefault(stage, Histogram()).add(value)
+
+    def merge(self, other):
+        with self._lock, other._lock:
+            for stage, histogram in other.stages.items():
+                self.stages.setdefault(stage, Histogram()).merge(histogram)
+        return self
+
+    def summary(self):
+        with self._lock:
+            return {stage: histogram.summary()
+                    for stage, histogram in self.stages.items()}
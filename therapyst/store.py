@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+"""
+Bounded store of the Rants a controller holds until they are collected.
+
+RantStore keeps rants by key like a dict, but never holds more than
+max_entries of them or max_bytes of results in memory, and forgets rants
+older than ttl.  The least recently used go first.
+
+With spill_dir, results of spill_threshold bytes or more are appended to
+a log file there and read back through an mmap, so only small results
+cost memory.  The log is compacted once most of it is dead.
+"""
+
+import os
+import mmap
+import tempfile
+import threading
+
+from collections import OrderedDict
+from time import time
+
+from therapyst.data import Rant, BulkRant
+
+MIB = 1024 * 1024
+
+
+def result_size(rant):
+    """
+    Bytes of output a rant holds, which is what its budget counts
+    """
+    if isinstance(rant, BulkRant):
+        return sum(result_size(step) for step in rant.rants)
+    result = getattr(rant, "result", None)
+    if isinstance(result, (bytes, bytearray, str)):
+        return len(result)
+    if isinstance(result, memoryview):
+        return result.nbytes
+    return 0
+
+
+class SpillLog():
+
+    """
+    Append only file of results.  Reads go through an mmap that is
+    remapped when the file has grown past it.  The file is unlinked as
+    soon as it is created, so nothing is left behind however the
+    process ends
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix="rants-", suffix=".log",
+                                    dir=directory)
+        os.unlink(path)
+        self._file = os.fdopen(fd, "r+b")
+        self._map = None
+        self.size = 0
+
+    def append(self, data):
+        offset = self.size
+        self._file.seek(offset)
+        self._file.write(data)
+        self._file.flush()
+        self.size += len(data)
+        return offset
+
+    def read(self, offset, length):
+        if self._map is None or len(self._map) < offset + length:
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), self.size,
+                                  access=mmap.ACCESS_READ)
+        return self._map[offset:offset + length]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+class RantStore():
+
+    """
+    Dict like store of rants with LRU, TTL and byte budget eviction and
+    optional spill of large results to disk.  stats counts hits, misses,
+    evictions (to stay within budget), expired rants, the rants and bytes
+    spilled, and the result bytes currently held in memory
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=256 * MIB, ttl=None,
+                 spill_dir=None, spill_threshold=64 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.spill_threshold = spill_threshold
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0,
+                      "spilled": 0, "spilled_bytes": 0, "bytes": 0}
+        # {key: [expires, rant, bytes in memory, (offset, length, was_str)]}
+        self._entries = OrderedDict()
+        self._log = None
+        self._live_spill = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._fresh(key) is not None
+
+    def __getitem__(self, key):
+        with self._lock:
+            entry = self._fresh(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                raise KeyError(key)
+            self.stats["hits"] += 1
+            self._entries.move_to_end(key)
+            return self._load(entry)
+
+    def __setitem__(self, key, rant):
+        self.put(key, rant)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        with self._lock:
+            try:
+                rant = self[key]
+            except KeyError:
+                if default:
+                    return default[0]
+                raise
+            self._remove(key)
+            return rant
+
+    def put(self, key, rant, ttl=None):
+        ttl = ttl if ttl is not None else self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            size, spill = result_size(rant), None
+            if self._spillable(rant, size):
+                rant, spill = self._spill(rant)
+                size = 0
+            self._entries[key] = [time() + ttl if ttl else None, rant, size,
+                                  spill]
+            self.stats["bytes"] += size
+            self._evict()
+
+    def close(self):
+        """
+        Forget every rant and close the spill log
+        """
+        with self._lock:
+            self._entries.clear()
+            self.stats["bytes"] = 0
+            self._live_spill = 0
+            if self._log:
+                self._log.close()
+                self._log = None
+
+    def _fresh(self, key):
+        entry = self._entries.get(key)
+        if entry and entry[0] is not None and entry[0] <= time():
+            self._remove(key)
+            self.stats["expired"] += 1
+            return None
+        return entry
+
+    def _spillable(self, rant, size):
+        return self.spill_dir and size >= self.spill_threshold and \
+            isinstance(rant, Rant)
+
+    def _spill(self, rant):
+        result = rant.result
+        was_str = isinstance(result, str)
+        data = result.encode("utf-8") if was_str else bytes(result)
+        if not self._log:
+            self._log = SpillLog(self.spill_dir)
+        offset = self._log.append(data)
+        self._live_spill += len(data)
+        self.stats["spilled"] += 1
+        self.stats["spilled_bytes"] += len(data)
+        return rant._replace(result=None), (offset, len(data), was_str)
+
+    def _load(self, entry):
+        rant, spill = entry[1], entry[3]
+        if not spill:
+            return rant
+        offset, length, was_str = spill
+        data = self._log.read(offset, length)
+        return rant._replace(result=data.decode("utf-8") if was_str
+                             else data)
+
+    def _remove(self, key):
+        _, _, size, spill = self._entries.pop(key)
+        self.stats["bytes"] -= size
+        if spill:
+            self._live_spill -= spill[1]
+            self._compact()
+
+    def _evict(self):
+        # Expired rants at the cold end go first, then whatever is least
+        # recently used until within budget.  The newest rant always stays
+        now = time()
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry[0] is None or entry[0] > now:
+                break
+            self._remove(key)
+            self.stats["expired"] += 1
+        while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or
+                self.stats["bytes"] > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+            self.stats["evictions"] += 1
+
+    def _compact(self):
+        """
+        Rewrite the log with only its live results once they are less
+        than half of it, or drop it when none are left
+        """
+        if not self._log:
+            return
+        if not self._live_spill:
+            self._log.close()
+            self._log = None
+            return
+        if self._log.size < self.spill_threshold * 16 or \
+                self._live_spill * 2 > self._log.size:
+            return
+        old, self._log = self._log, SpillLog(self.spill_dir)
+        for entry in self._entries.values():
+            if entry[3]:
+                offset, length, was_str = entry[3]
+                entry[3] = (self._log.append(old.read(offset, length)),
+                            length, was_str)
+        old.close()
@@ -1,14 +1,30 @@
 #!/usr/bin/env python
 
 import sys
+import math
+import queue
 import logging
 import threading
 import time
 
+from concurrent.futures import ThreadPoolExecutor, InvalidStateError, \
+    as_completed, wait
+from functools import partial
 from uuid import uuid4
+from collections import OrderedDict
 
-from therapyst.client import Client
-from therapyst.data import AdviceQueue
+import zmq
+
+from therapyst.client import Client, REQUIREMENTS, OVERLOAD_POLICIES, \
+    ADVICE_DEFAULT_PORT
+from therapyst.codec import get_codec
+from therapyst.deploy import build_wheelhouse
+from therapyst.data import adviceFactory, PriorityAdviceQueue, GroupRant, \
+    InstallSummary
+from therapyst.poller import shared_context, shared_poller
+from therapyst.stats import LatencyStats
+from therapyst.store import RantStore
+from therapyst.transport import endpoint
 
 LOG = logging.getLogger(__name__)
 logging.getLogger("paramiko").setLevel(logging.WARNING)
@@ -19,9 +35,14 @@ logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
 class Therapyst():
 
     """
+    Routes advice to the named TherapyGroups of data_struct.  A host in
+    several groups gets a single Client (and daemon, sockets and member
+    thread) however many groups it is in, and advice given to several
+    groups at once reaches each host only once.  Results are indexed by
+    group name, then by member name as written in that group
     """
 
-    def __init__(self, data_struct):
+    def __init__(self, data_struct, name="therapyst", **group_kwargs):
         """
         :param data_struct: Initialization data structure
 
@@ -43,32 +64,343 @@ class Therapyst():
                                 "password": mypass}
             }
 
+            Any other keys of a client (eg. advice_port) are passed on to
+            its Client.  Hosts are told apart by ip and advice_port, the
+            first group to name a host decides its settings
+
+        :param group_kwargs: passed on to the TherapyGroup of every host
         """
         self.data_struct = data_struct
+        # {(ip, advice_port): Client}
+        self.clients = OrderedDict()
+        # {group name: {member name: Client}}
+        self.groups = OrderedDict()
+        for group_name, members in data_struct.items():
+            self.groups[group_name] = OrderedDict(
+                (member_name, self._client(member_name, spec))
+                for member_name, spec in members.items())
+        self.fleet = TherapyGroup(list(self.clients.values()), name=name,
+                                  **group_kwargs)
+        # {advice id: group names} of the last max_rants advice.  Rants
+        # are read from the fleet's RantStore, so they stay within its
+        # budget, and from its pending GroupFutures
+        self._routes = OrderedDict()
+
+    def _client(self, name, spec):
+        options = {key: value for key, value in spec.items()
+                   if key not in ("ip", "username", "password")}
+        host = (spec["ip"], options.get("advice_port", ADVICE_DEFAULT_PORT))
+        if host not in self.clients:
+            self.clients[host] = Client(spec["ip"], spec["username"],
+                                        spec["password"], name=name,
+                                        **options)
+        return self.clients[host]
+
+    def _group_names(self, groups):
+        if groups is None:
+            return list(self.groups)
+        if isinstance(groups, str):
+            groups = [groups]
+        unknown = [group for group in groups if group not in self.groups]
+        if unknown:
+            raise ValueError("Unknown TherapyGroups {}, choose from {}".format(
+                ", ".join(unknown), ", ".join(self.groups)))
+        return list(groups)
+
+    def install_and_start_daemons(self, **kwargs):
+        """
+        Bootstrap every host once, see TherapyGroup.install_and_start_daemons
+        """
+        return self.fleet.install_and_start_daemons(**kwargs)
+
+    def start(self):
+        self.fleet.start()
+
+    def close(self):
+        self.fleet.close()
+
+    def give_advice(self, advice, groups=None):
+        """
+        Give advice to the named groups (a name or a list of names), every
+        group by default.  Hosts shared by those groups get it once.
+
+        Returns the GroupFuture of the hosts it was sent to
+        """
+        names = self._group_names(groups)
+        if advice.group is None:
+            advice = advice._replace(group=",".join(names))
+        members = list(OrderedDict.fromkeys(
+            client for group in names
+            for client in self.groups[group].values()))
+        if len(members) == len(self.fleet.members):
+            # Every host, which a broadcast fleet can publish
+            members = None
+        group_future = self.fleet.give_advice(advice, members=members)
+        self._routes[advice.id] = names
+        while len(self._routes) > self.fleet.max_rants:
+            self._routes.popitem(last=False)
+        return group_future
+
+    def _route(self, advice):
+        try:
+            return self._routes[advice.id]
+        except KeyError:
+            raise KeyError("Advice {} was not given to this Therapyst".format(
+                advice.id)) from None
+
+    def _by_group(self, advice, names, group_future):
+        """
+        Split what the hosts said so far into a GroupRant per group.
+        Without the GroupFuture (advice no longer pending) failed hosts
+        can't be told from stragglers
+        """
+        split = {}
+        for group in names:
+            rants, stragglers, errors = {}, [], {}
+            for member_name, client in self.groups[group].items():
+                rant = self.fleet.rants.get((client, advice.id))
+                future = group_future.futures.get(client) \
+                    if group_future else None
+                if rant is not None:
+                    rants[member_name] = rant
+                elif future and future.done() and \
+                        future.exception() is not None:
+                    errors[member_name] = future.exception()
+                else:
+                    stragglers.append(member_name)
+            split[group] = GroupRant(rants, stragglers, errors)
+        return split
+
+    def hear_rant(self, advice, timeout=None):
+        """
+        Wait for every host and return {group: {member name: rant}}
+        """
+        names = self._route(advice)
+        group_future = self.fleet._group_futures.get(advice.id)
+        if group_future:
+            group_future.result(timeout)
+        return {group: {member_name: self.fleet.rants[(client, advice.id)]
+                        for member_name, client in self.groups[group].items()}
+                for group in names}
+
+    def gather_rants(self, advice, quorum=None, timeout=None, grace=0,
+                     raise_on_timeout=False):
+        """
+        Like TherapyGroup.gather_rants, quorum counting hosts across all
+        the groups advised.  Returns {group: GroupRant}
+        """
+        names = self._route(advice)
+        group_future = self.fleet._group_futures.get(advice.id)
+        if group_future:
+            group_future.gather(quorum, timeout, grace, raise_on_timeout)
+        return self._by_group(advice, names, group_future)
+
+    def cancel(self, advice):
+        """
+        Cancel advice on every host that hasn't ranted about it yet
+        """
+        self._route(advice)
+        group_future = self.fleet._group_futures.get(advice.id)
+        if not group_future:
+            return
+        for client, future in group_future.futures.items():
+            if not future.done():
+                client.cancel(advice, block=False)
+
+    def stats(self, daemons=False, timeout=None):
+        return self.fleet.stats(daemons, timeout)
+
+
+class GroupFuture():
+
+    """
+    Aggregate of the per-member Futures for a single advice given to a
+    TherapyGroup.  Completes once every member has ranted
+    """
+
+    def __init__(self, advice, futures):
+        """
+        :param futures: dict of {member: Future}
+        """
+        self.advice = advice
+        self.futures = futures
+        self._lock = threading.Condition()
+        self._pending = len(futures)
+        self._done = threading.Event()
+        self._callbacks = []
+        if not self._pending:
+            self._done.set()
+        for future in futures.values():
+            future.add_done_callback(self._member_done)
+
+    def _member_done(self, future):
+        with self._lock:
+            self._pending -= 1
+            self._lock.notify_all()
+            if self._pending:
+                return
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def _needed(self, quorum):
+        total = len(self.futures)
+        if quorum is None:
+            return total
+        if isinstance(quorum, float):
+            if not 0 < quorum <= 1:
+                raise ValueError("A quorum fraction must be in (0, 1]")
+            return min(total, int(math.ceil(quorum * total)))
+        return min(total, quorum)
+
+    def gather(self, quorum=None, timeout=None, grace=0,
+               raise_on_timeout=False):
+        """
+        Wait until quorum members have ranted, or timeout seconds pass,
+        then give the rest up to grace more seconds.  Rants arriving later
+        are still collected, calling gather again picks them up.
+
+        :param quorum: member count, or fraction of the group as a float.
+                       Defaults to every member
+        :param raise_on_timeout: raise TimeoutError instead of returning
+                                 partial results when quorum isn't reached
+        :returns: GroupRant
+        """
+        needed = self._needed(quorum)
+        total = len(self.futures)
+        with self._lock:
+            reached = self._lock.wait_for(
+                lambda: total - self._pending >= needed, timeout)
+            if reached and grace and self._pending:
+                self._lock.wait_for(lambda: not self._pending, grace)
+        if not reached and raise_on_timeout:
+            raise TimeoutError(
+                "Only {} of the {} members needed ranted about advice {} "
+                "within {} seconds".format(total - self._pending, needed,
+                                           self.advice.id, timeout))
+        return self.partial()
+
+    def partial(self):
+        """
+        GroupRant of whatever has been heard so far, without waiting
+        """
+        rants, stragglers, errors = {}, [], {}
+        for member, future in self.futures.items():
+            if not future.done():
+                stragglers.append(member.name)
+            elif future.exception() is not None:
+                errors[member.name] = future.exception()
+            else:
+                rants[member.name] = future.result()
+        return GroupRant(rants, stragglers, errors)
+
+    def add_done_callback(self, fn):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for every member and return {member.name: rant}
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError(
+                "{} of {} members have not ranted about advice {}".format(
+                    self._pending, len(self.futures), self.advice.id))
+        return {member.name: future.result()
+                for member, future in self.futures.items()}
 
 
 class TherapyGroup():
 
+    """
+    With broadcast=True advice is serialized once and published on a PUB
+    socket connected to every member's broadcast port instead of being
+    sent to each member separately.  Members that can't be confirmed as
+    subscribed when the group starts keep getting advice one by one
+
+    A member not heard from (by heartbeat, ack or rant) for member_timeout
+    seconds is marked down within watch_interval more seconds.  Its daemon
+    is then restarted, or with raise_on_timeout its outstanding advice
+    fails with an EnvironmentError instead.  member_timeout should be
+    longer than the members' heartbeat_interval
+
+    At most max_queued advice wait to be sent to each member.  With
+    overload="block" give_advice waits for room, with "reject" it raises
+    an IOError instead.  The last max_rants rants heard by the group are
+    kept for hear_rant and gather_rants, or pass a RantStore as rant_store
+    for a byte budget, TTL or spilling large results to disk
+
+    Queued advice is sent by Advice.priority.  Advice is tagged with the
+    group's name so daemons shared with other groups take turns between
+    them
+    """
+
     def __init__(self, members, name=None, member_timeout=30,
-                 raise_on_timeout=False):
+                 raise_on_timeout=False, broadcast=False, codec="json",
+                 join_timeout=10, watch_interval=1, max_queued=10000,
+                 overload="block", max_rants=10000, rant_store=None):
+        if overload not in OVERLOAD_POLICIES:
+            raise ValueError("Unknown overload policy {}, choose from "
+                             "{}".format(overload,
+                                         ", ".join(OVERLOAD_POLICIES)))
         self.name = name if name else uuid4()
         self.members = members
         self._member_set = None
-        self._advice_queues = {member: AdviceQueue()
+        self.max_queued = max_queued
+        self.overload = overload
+        self.max_rants = max_rants
+        self._advice_queues = {member: PriorityAdviceQueue(maxsize=max_queued)
                                for member in self.members}
-        self._rant_dicts = {member: {}
-                            for member in self.members}
+        # {(member, advice id): rant}
+        self.rants = rant_store if rant_store is not None else \
+            RantStore(max_entries=max_rants)
+        self._group_futures = {}
         self.member_threads = []
-        self.member_watch_thread = None
+        self.started = False
+        self.member_watch_timer = None
+        self.watch_interval = watch_interval
+        # {member: time it was marked down}
+        self.down = {}
+        self._member_seen = {}
+        self._restarting = set()
         self.stop = False
         self._member_timeout = member_timeout
         self._raise_on_timeout = raise_on_timeout
+        self.broadcast = broadcast
+        self.join_timeout = join_timeout
+        self._codec = get_codec(codec)
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+        self._subscribed = set()
+
+    @property
+    def topic(self):
+        # Subscriptions match by prefix, the terminator stops group "web"
+        # from also hearing group "web2"
+        return "{}\x00".format(self.name)
 
     def add_member(self, new_member):
         self.members.append(new_member)
         self._member_set = None
+        self._advice_queues.setdefault(
+            new_member, PriorityAdviceQueue(maxsize=self.max_queued))
+        if self.started:
+            # Direct advice, also while it hasn't joined the broadcast
+            self._start_member_thread(new_member)
+        if self._publisher:
+            self._join_broadcast([new_member])
 
     def remove_member(self, member_name):
+        for member in self.members:
+            if member.name == member_name and member in self._subscribed:
+                self._leave_broadcast(member)
         self.members = [member for member in self.members
                         if member.name != member_name]
         self._member_set = None
@@ -87,51 +419,100 @@ class TherapyGroup():
         return key in self.member_set
 
     def _setup_member_watch(self):
-        thread = threading.Thread(target=self._member_watch,
-                                  name="member_watch")
-        thread.daemon = True
-        thread.start()
-        self.member_watch_thread = thread
+        now = time.time()
+        self._member_seen = {member: now for member in self.members}
+        self.member_watch_timer = shared_poller().call_later(
+            self.watch_interval, self._member_watch)
 
     def _setup_member_threads(self):
         for member in self.members:
-            thread = threading.Thread(target=self._member_func,
-                                      args=(member, ),
-                                      name=member.name)
-            thread.daemon = True
-            thread.start()
-            self.member_threads.append(thread)
+            self._start_member_thread(member)
+
+    def _start_member_thread(self, member):
+        thread = threading.Thread(target=self._member_func,
+                                  args=(member, ),
+                                  name=member.name)
+        thread.daemon = True
+        thread.start()
+        self.member_threads.append(thread)
 
     def _member_watch(self):
         """
         Auto restart client daemon processes on remote machines based
-        on heartbeats
+        on when they were last heard from.  Timer callback in the poller
+        thread, restarts happen on threads of their own
         """
-        member_watch = {member: time.time() for member in self.members}
-        while not self.stop:
-            for member, heartbeat in self.heartbeats:
-                if (not heartbeat and
-                        member_watch[member] >= self._member_timeout):
-                    if self._raise_on_timeout:
-                        raise EnvironmentError(
-                            "Member: {} of TherapyGroup: {} timed out after {} "
-                            "seconds of not responding to heartbeat "
-                            "requests".format(
-                                member,
-                                self.name,
-                                time.time() - member_watch[member]))
-                    else:
-                        member.start_daemon()
-                elif heartbeat:
-                    member_watch[member] = time.time()
+        if self.stop:
+            return
+        now = time.time()
+        for member in self.members:
+            last_seen = member.last_seen or 0
+            if member in self.down and last_seen > self.down[member]:
+                LOG.info("Member {} of TherapyGroup {} is back".format(
+                    member.name, self.name))
+                del self.down[member]
+            since = now - max(last_seen,
+                              self._member_seen.setdefault(member, now))
+            if since < self._member_timeout or member in self._restarting:
+                continue
+            self.down.setdefault(member, now)
+            # Act on a member at most once per member_timeout
+            self._member_seen[member] = now
+            error = EnvironmentError(
+                "Member: {} of TherapyGroup: {} timed out after {:.1f} "
+                "seconds of not responding to heartbeat "
+                "requests".format(member.name, self.name, since))
+            LOG.error(error)
+            if self._raise_on_timeout:
+                self._fail_member(member, error)
+            else:
+                self._restarting.add(member)
+                thread = threading.Thread(target=self._restart_member,
+                                          args=(member, ),
+                                          name="restart-{}".format(
+                                              member.name))
+                thread.daemon = True
+                thread.start()
+        self.member_watch_timer = shared_poller().call_later(
+            self.watch_interval, self._member_watch)
+
+    def _restart_member(self, member):
+        try:
+            member.start_daemon()
+        except Exception:
+            LOG.exception("Could not restart member {}".format(member.name))
+        finally:
+            self._member_seen[member] = time.time()
+            self._restarting.discard(member)
+
+    def _fail_member(self, member, error):
+        for group_future in list(self._group_futures.values()):
+            future = group_future.futures.get(member)
+            if future and not future.done():
+                try:
+                    future.set_exception(error)
+                except InvalidStateError:
+                    # The rant arrived after all
+                    pass
 
     def _member_func(self, member):
         advice_queue = self._advice_queues[member]
-        rant_dict = self._rant_dicts[member]
         while not self.stop:
-            advice = advice_queue.get()
-            result = member.send_and_receive(advice)
-            rant_dict[advice.id] = result
+            try:
+                # Wake up now and then to notice close()
+                advice = advice_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                member.send_advice(advice, block=False)
+            except IOError as e:
+                LOG.error("Could not give advice {} to member {}: {}".format(
+                    advice.id, member.name, e))
+
+    def _store_rant(self, member, advice, future):
+        if future.exception() is None:
+            self.rants[(member, advice.id)] = member.get_rant(
+                advice, block=False) or future.result()
 
     @classmethod
     def from_dict(cls, data_struct, name=None):
@@ -149,25 +530,274 @@ class TherapyGroup():
                    for n, c in data_struct.items()]
         return cls(clients, name=name)
 
+    def install_and_start_daemons(self, max_workers=16,
+                                  raise_on_error=False, wheelhouse=False,
+                                  pip_args=()):
+        """
+        Bootstrap every member concurrently, at most max_workers at a time,
+        logging progress as each host finishes.
+
+        With wheelhouse=True the requirements are built into a wheelhouse
+        once here (see therapyst.deploy.build_wheelhouse for pip_args) and
+        pushed to every member, which then installs with no index access.
+        A wheelhouse archive built earlier can be passed instead.
+
+        :returns: InstallSummary of succeeded member names, {name: exception}
+                  for failures and {name: seconds} for every member
+        """
+        succeeded, failed, durations = [], {}, {}
+        start = time.time()
+        if wheelhouse is True:
+            wheelhouse = build_wheelhouse(REQUIREMENTS, pip_args)
+            LOG.info("Built {} byte wheelhouse in {:.1f}s".format(
+                len(wheelhouse), time.time() - start))
+
+        def install(member):
+            member_start = time.time()
+            try:
+                member.install_and_start_daemon(wheelhouse=wheelhouse or None)
+            finally:
+                durations[member.name] = time.time() - member_start
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(install, member): member
+                       for member in self.members}
+            for done, future in enumerate(as_completed(futures), 1):
+                member = futures[future]
+                error = future.exception()
+                if error:
+                    failed[member.name] = error
+                    LOG.error("[{}/{}] {} failed after {:.1f}s: {}".format(
+                        done, len(futures), member.name,
+                        durations[member.name], error))
+                else:
+                    succeeded.append(member.name)
+                    LOG.info("[{}/{}] {} started in {:.1f}s".format(
+                        done, len(futures), member.name,
+                        durations[member.name]))
+        LOG.info("TherapyGroup {} bootstrapped {} of {} members in {:.1f}s, "
+                 "slowest {:.1f}s".format(
+                     self.name, len(succeeded), len(self.members),
+                     time.time() - start, max(durations.values(), default=0)))
+        if failed and raise_on_error:
+            raise EnvironmentError("Could not bootstrap members: {}".format(
+                ", ".join(sorted(failed))))
+        return InstallSummary(succeeded, failed, durations)
+
     def start(self):
+        self.started = True
         self._setup_member_threads()
         self._setup_member_watch()
+        if self.broadcast:
+            self._publisher = shared_context().socket(zmq.PUB)
+            self._publisher.setsockopt(zmq.LINGER, 0)
+            self._publisher.setsockopt(zmq.SNDHWM, self.max_queued)
+            self._join_broadcast(self.members)
+
+    def close(self):
+        """
+        Stop giving advice and watching the members, then close them
+        """
+        self.stop = True
+        if self.member_watch_timer:
+            self.member_watch_timer.cancel()
+        if self._publisher:
+            with self._publish_lock:
+                self._publisher.close()
+            self._publisher = None
+        for member in self.members:
+            member.close()
+        self.started = False
+
+    @staticmethod
+    def _broadcast_endpoint(member):
+        return endpoint(member.protocol, member.ip, member.broadcast_port)
+
+    def _join_broadcast(self, members):
+        """
+        Connect the publisher to members and subscribe them to our topic,
+        then publish probes until each has answered one (a PUB socket
+        silently drops messages until the connection is up)
+        """
+        for member in members:
+            member.send_control(adviceFactory(self.topic, type="subscribe"),
+                                block=False)
+        pending = []
+        for member in members:
+            try:
+                member.flush_advice()
+            except IOError as e:
+                LOG.warning("Could not subscribe member {}: {}".format(
+                    member.name, e))
+                continue
+            with self._publish_lock:
+                self._publisher.connect(self._broadcast_endpoint(member))
+            pending.append(member)
+        deadline = time.time() + self.join_timeout
+        while pending and time.time() < deadline:
+            probe = adviceFactory(type="heartbeat")
+            futures = {member: member.expect_rant(probe) for member in pending}
+            self._publish(probe)
+            wait(futures.values(), timeout=0.1)
+            for member, future in futures.items():
+                member.get_rant(probe, block=False)
+                if future.done():
+                    self._subscribed.add(member)
+            pending = [member for member in pending
+                       if member not in self._subscribed]
+        for member in pending:
+            LOG.warning("Member {} of TherapyGroup {} did not join the "
+                        "broadcast, advising it directly".format(member.name,
+                                                                 self.name))
 
-    def give_advice(self, advice):
+    def _leave_broadcast(self, member):
+        self._subscribed.discard(member)
+        with self._publish_lock:
+            self._publisher.disconnect(self._broadcast_endpoint(member))
+        try:
+            member.send_control(adviceFactory(self.topic, type="unsubscribe"))
+        except IOError as e:
+            LOG.warning("Could not unsubscribe member {}: {}".format(
+                member.name, e))
+
+    def _publish(self, advice):
+        with self._publish_lock:
+            self._publisher.send_multipart(
+                [self.topic.encode("utf-8")] + self._codec.encode(advice),
+                copy=False)
+
+    def give_advice(self, advice, members=None):
         """
         Main entry point for interacting with therapyst
+
+        :param members: give the advice to only these members.  They are
+                        sent it one by one even in a broadcast group
         """
         # if not any(self.member_threads):
         #     self._setup_member_threads()
         # if not self.member_watch_thread:
         #     self._setup_member_watch()
-        for member in self.members:
+        if advice.group is None:
+            advice = advice._replace(group=str(self.name))
+        targets, subscribed = self.members, self._subscribed
+        if members is not None:
+            wanted = set(members)
+            targets = [member for member in self.members if member in wanted]
+            subscribed = set()
+        direct = [member for member in targets if member not in subscribed]
+        if self.overload == "reject":
+            full = [member.name for member in direct
+                    if self._advice_queues[member].full()]
+            if full:
+                raise IOError("Advice queue full for members {}".format(
+                    ", ".join(full)))
+        futures = {}
+        for member in targets:
+            future = member.expect_rant(advice)
+            future.add_done_callback(partial(self._store_rant, member, advice))
+            futures[member] = future
+        group_future = GroupFuture(advice, futures)
+        self._group_futures[advice.id] = group_future
+        group_future.add_done_callback(
+            lambda f: self._group_futures.pop(advice.id, None))
+        if subscribed:
+            # One serialization and one send for every subscribed member.
+            # Each still holds a credit of its Client until it rants
+            for member in subscribed:
+                try:
+                    member.take_credit(advice)
+                except IOError as e:
+                    futures[member].set_exception(e)
+                    continue
+                member.mark_sent(advice)
+            self._publish(advice)
+        for member in direct:
             self._advice_queues[member].put(advice)
+        return group_future
 
-    def hear_rant(self, advice):
-        while True:
-            try:
-                return {member.name: self._rant_dicts[member][advice.id]
-                        for member in self.members}
-            except KeyError:
-                pass
+    def cancel(self, advice):
+        """
+        Cancel advice on every member that hasn't ranted about it yet, eg.
+        the stragglers left by gather_rants
+        """
+        group_future = self._group_futures.get(advice.id)
+        if not group_future:
+            # Every member has ranted already
+            return
+        for member, future in group_future.futures.items():
+            if not future.done():
+                member.cancel(advice, block=False)
+
+    def stats(self, daemons=False, timeout=None):
+        """
+        Latency percentiles of each stage (see therapyst.stats) per member
+        and for the whole group.  With daemons=True every member's daemon
+        is asked for its own stats too, members that don't answer within
+        timeout get the error instead.  "rants" holds the counters of
+        the group's RantStore
+
+            {"group": {stage: {"p50": s, ...}},
+             "rants": {"evictions": n, "spilled_bytes": n, ...},
+             "members": {name: {"latency": {stage: {...}},
+                                "daemon": {...}}}}
+        """
+        group = LatencyStats()
+        members = {}
+        for member in self.members:
+            members[member.name] = {"latency": member.latency.summary()}
+            group.merge(member.latency)
+        if daemons:
+            asked = {}
+            for member in self.members:
+                advice = adviceFactory(type="stats")
+                try:
+                    member.send_advice(advice, block=False)
+                    asked[member] = advice
+                except IOError as e:
+                    members[member.name]["daemon"] = {"error": str(e)}
+            for member, advice in asked.items():
+                try:
+                    members[member.name]["daemon"] = member.get_rant(
+                        advice, timeout=timeout).result
+                except (TimeoutError, EnvironmentError) as e:
+                    # eg. the advice failed on an ack timeout or the member
+                    # was found down
+                    members[member.name]["daemon"] = {"error": str(e) or
+                                                      "timed out"}
+        return {"group": group.summary(), "rants": dict(self.rants.stats),
+                "members": members}
+
+    def stream_rants(self, advice, timeout=None):
+        """
+        For streaming advice, returns {member.name: iterator} over each
+        member's output chunks as they are produced
+        """
+        return {member.name: member.iter_rant(advice, timeout=timeout)
+                for member in self.members}
+
+    def hear_rant(self, advice, timeout=None):
+        future = self._group_futures.get(advice.id)
+        if future:
+            return future.result(timeout)
+        return {member.name: self.rants[(member, advice.id)]
+                for member in self.members}
+
+    def gather_rants(self, advice, quorum=None, timeout=None, grace=0,
+                     raise_on_timeout=False):
+        """
+        Like hear_rant, but returns once quorum members (a count, or a
+        fraction of the group as a float) have ranted or the timeout
+        expires, giving stragglers up to grace more seconds.  Returns a
+        GroupRant of the rants so far and the names of the stragglers;
+        call again later to collect late rants
+        """
+        future = self._group_futures.get(advice.id)
+        if future:
+            return future.gather(quorum, timeout, grace, raise_on_timeout)
+        rants = {}
+        for member in self.members:
+            rant = self.rants.get((member, advice.id))
+            if rant is not None:
+                rants[member.name] = rant
+        return GroupRant(rants, [member.name for member in self.members
+                                 if member.name not in rants], {})
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+
+"""
+Endpoints of the advice, rant and broadcast channels.
+
+    tcp     tcp://host:port, the default
+    ipc     a Unix socket per port, for daemons on the controller's host.
+            host is the directory the sockets live in when it is an
+            absolute path, IPC_DIR otherwise
+    inproc  daemons running inside the controller's process.  Both sides
+            must use the same zmq.Context, eg. shared_context()
+
+ipc and inproc only use port to tell channels and daemons apart.
+"""
+
+import os
+import tempfile
+
+PROTOCOLS = ("tcp", "ipc", "inproc")
+IPC_DIR = os.path.join(tempfile.gettempdir(), "therapyst")
+
+
+def ipc_dir(host):
+    return host if host and os.path.isabs(host) else IPC_DIR
+
+
+def endpoint(protocol, host, port):
+    if protocol == "ipc":
+        return "ipc://{}".format(
+            os.path.join(ipc_dir(host), "therapyst-{}".format(port)))
+    if protocol == "inproc":
+        return "inproc://therapyst-{}".format(port)
+    if protocol == "tcp":
+        return "tcp://{}:{}".format(host, port)
+    raise ValueError("Unknown protocol {}, choose from {}".format(
+        protocol, ", ".join(PROTOCOLS)))
+
+
+def bind_endpoint(protocol, host, port):
+    """
+    Endpoint for the daemon to bind, creating the ipc directory if needed
+    """
+    if protocol == "ipc":
+        os.makedirs(ipc_dir(host), exist_ok=True)
+    return endpoint(protocol, host, port)